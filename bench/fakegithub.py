@@ -0,0 +1,139 @@
+"""A local stand-in for the github remote, for benchmarks
+
+Plug it in with, in the [git] section of skein.cfg::
+
+    remote_module = fakegithub
+    remote_class = FakeGithubRemote
+
+with bench/ on sys.path.  Repositories are bare git repositories under
+remote_root in the [bench] section, so pushes are real.  Requests, repos
+and teams are shared by every instance in the process, as they would be
+on github, and every call is counted and can be given a latency.
+"""
+
+import os
+import time
+import threading
+import subprocess
+
+from skein import metrics
+
+_lock = threading.Lock()
+_state = {'requests': {}, 'teams': {}, 'next_id': 1, 'calls': {}}
+
+def add_requests(requests):
+    """Open new repo requests
+
+    :param list requests: (name, summary, url, gitowner) tuples
+    :returns: the new request ids
+    """
+
+    ids = []
+    with _lock:
+        for name, summary, url, gitowner in requests:
+            request_id = _state['next_id']
+            _state['next_id'] += 1
+            _state['requests'][request_id] = {'name': name, 'summary': summary, 'url': url,
+                    'gitowner': gitowner, 'state': 'open'}
+            ids.append(request_id)
+    return ids
+
+def calls():
+    """Return a dict of method name to number of calls made"""
+
+    with _lock:
+        return dict(_state['calls'])
+
+def reset():
+    with _lock:
+        _state['requests'].clear()
+        _state['teams'].clear()
+        _state['calls'].clear()
+        _state['next_id'] = 1
+
+class FakeGithubRemote(object):
+
+    def __init__(self, cfgs, logger):
+        self.name = 'FakeGithubRemote'
+        self.cfgs = cfgs
+        self.logger = logger
+        self.root = cfgs['bench']['remote_root']
+        self.latency = float(cfgs['bench'].get('github_latency', 0))
+
+    def __str__(self):
+        return self.name
+
+    def _call(self, method):
+        metrics.count(rpcs=1)
+        with _lock:
+            _state['calls'][method] = _state['calls'].get(method, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _request(self, request_id):
+        request = _state['requests'].get(int(request_id))
+        if request is None:
+            raise Exception("No request %s" % request_id)
+        return request
+
+    def request_repo(self, name, summary=False, url=False, force=False):
+        self._call('request_repo')
+        add_requests([(name, summary or '', url or '', None)])
+
+    def list_repo_requests(self, state='open'):
+        self._call('list_repo_requests')
+        with _lock:
+            return sorted([i for i, r in _state['requests'].items() if r['state'] == state])
+
+    def search_repo_requests(self, state='open'):
+        for request_id in self.list_repo_requests(state):
+            print "%s: %s" % (request_id, self._request(request_id)['name'])
+
+    def show_request_by_id(self, request_id):
+        self._call('show_request_by_id')
+        request = self._request(request_id)
+        return request['name'], request['summary'], request['url'], request['gitowner']
+
+    def request_is_open(self, request_id):
+        self._call('request_is_open')
+        return self._request(request_id)['state'] == 'open'
+
+    def close_repo_request(self, request_id, name):
+        self._call('close_repo_request')
+        with _lock:
+            self._request(request_id)['state'] = 'closed'
+
+    def revoke_repo_request(self, request_id, name):
+        self._call('revoke_repo_request')
+        with _lock:
+            self._request(request_id)['state'] = 'closed'
+
+    def _bare_repo(self, name):
+        path = os.path.join(self.root, "%s.git" % name)
+        if not os.path.isdir(path):
+            devnull = open(os.devnull, 'w')
+            try:
+                subprocess.call(['git', 'init', '-q', '--bare', path], stdout=devnull)
+            finally:
+                devnull.close()
+        return path
+
+    def create_remote_repo(self, name, summary, url):
+        self._call('create_remote_repo')
+        self._bare_repo(name)
+
+    def create_team(self, name, permission, gitowner, repos):
+        self._call('create_team')
+        with _lock:
+            _state['teams'][name] = (permission, gitowner, list(repos))
+
+    def sync_teams(self, force=False):
+        self._call('sync_teams')
+
+    def get_scm_url(self, name):
+        # repos are made on first use, so imports work without a grant
+        return self._bare_repo(name)
+
+    def repo_info(self, name):
+        self._call('repo_info')
+        return {'name': name, 'size': 0, 'commits': {}}
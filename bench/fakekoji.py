@@ -0,0 +1,263 @@
+"""A local stand-in for a koji hub, speaking XML-RPC
+
+Only the calls skein makes are implemented.  Builds are scripted: each one
+spawns a task tree (buildSRPMFromSCM, a buildArch per arch, tagBuild), and
+each buildArch a createrepo child of its own, standing in for the nested
+tasks real hubs spawn (maven, image and chain builds).  The tasks open and
+close on a timetable, so watching them exercises the same
+state changes as a real hub without building anything.  A successful build
+is tagged, as name and name-devel rpms, when its task closes, and a new
+buildroot repo is made every repo_seconds.
+"""
+
+import time
+import random
+import threading
+import xmlrpclib
+import SocketServer
+
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+# koji.TASK_STATES
+FREE, OPEN, CLOSED, CANCELED, ASSIGNED, FAILED = range(6)
+
+class _Handler(SimpleXMLRPCRequestHandler):
+    # koji clients post to the hub url, whatever its path
+    rpc_paths = ()
+
+    def log_message(self, format, *args):
+        pass
+
+class _Server(SocketServer.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+class Task(object):
+
+    def __init__(self, task_id, method, request, parent=None, arch='noarch', start=0.0, duration=0.0,
+            host_id=None, fail=False):
+        self.id = task_id
+        self.method = method
+        self.request = request
+        self.parent = parent
+        self.arch = arch
+        self.start = start
+        self.duration = duration
+        self.host_id = host_id
+        self.fail = fail
+        self.children = []
+
+    def state(self, now):
+        if now < self.start:
+            return FREE
+        if self.children:
+            # a parent closes once all its children have
+            states = [child.state(now) for child in self.children]
+            if FAILED in states:
+                return FAILED
+            if [s for s in states if s != CLOSED]:
+                return OPEN
+            return CLOSED
+        if now < self.start + self.duration:
+            return OPEN
+        if self.fail:
+            return FAILED
+        return CLOSED
+
+    def end(self):
+        if self.children:
+            return max([child.end() for child in self.children])
+        return self.start + self.duration
+
+    def info(self, now, request=False):
+        state = self.state(now)
+        info = {'id': self.id, 'method': self.method, 'arch': self.arch, 'state': state,
+                'parent': self.parent, 'owner': 1, 'priority': 20, 'label': None,
+                'host_id': state == OPEN and self.host_id or None,
+                'create_ts': self.start, 'start_ts': self.start,
+                'completion_ts': state in (CLOSED, FAILED) and self.end() or None}
+        if request:
+            info['request'] = self.request
+        return info
+
+class FakeKojiHub(object):
+    """Serve a scripted koji hub on localhost
+
+    :param list arches: arches each build runs a buildArch task for
+    :param float task_seconds: how long each leaf task stays open
+    :param float fail_rate: fraction of builds whose first buildArch's
+                            createrepo child fails, failing the tree above it
+    :param int hosts: number of builder hosts tasks are spread over
+    :param float latency: seconds added to every request
+    :param float repo_seconds: seconds between buildroot repos (default: task_seconds)
+    """
+
+    def __init__(self, arches=('x86_64', 'i686'), task_seconds=2.0, fail_rate=0.0, hosts=4, latency=0.0,
+            repo_seconds=None):
+        self.arches = list(arches)
+        self.task_seconds = task_seconds
+        self.fail_rate = fail_rate
+        self.hosts = hosts
+        self.latency = latency
+        self.repo_seconds = repo_seconds or task_seconds
+        self.started = time.time()
+
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.next_id = 1000
+        self.tags = {}
+        self.builds = []
+        self.requests = 0
+        self.calls = {}
+
+        self.server = _Server(('127.0.0.1', 0), requestHandler=_Handler, allow_none=True, logRequests=False)
+        self.server.register_instance(self)
+        self.url = "http://127.0.0.1:%d/kojihub" % self.server.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fakekoji')
+        self.thread.setDaemon(True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        """Return (http requests, dict of method to calls)"""
+
+        with self.lock:
+            return self.requests, dict(self.calls)
+
+    def _dispatch(self, method, params):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if method == 'multiCall':
+            return self._multicall(params[0])
+        return self._call(method, params)
+
+    def _call(self, method, params):
+        params = list(params)
+        kwargs = {}
+        # koji sends keyword arguments as a trailing dict flagged __starstar
+        if params and isinstance(params[-1], dict) and params[-1].get('__starstar'):
+            kwargs = params.pop()
+            del kwargs['__starstar']
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        func = getattr(self, "rpc_%s" % method, None)
+        if func is None:
+            raise xmlrpclib.Fault(1000, "Invalid method: %s" % method)
+        return func(*params, **kwargs)
+
+    def _multicall(self, calls):
+        results = []
+        for call in calls:
+            try:
+                results.append([self._call(call['methodName'], call['params'])])
+            except xmlrpclib.Fault as e:
+                results.append({'faultCode': e.faultCode, 'faultString': e.faultString})
+            except Exception as e:
+                results.append({'faultCode': 1, 'faultString': str(e)})
+        return results
+
+    def _new_task(self, *args, **kwargs):
+        with self.lock:
+            self.next_id += 1
+            task = Task(self.next_id, *args, **kwargs)
+            self.tasks[task.id] = task
+        return task
+
+    def _task(self, task_id):
+        task = self.tasks.get(task_id)
+        if task is None:
+            raise xmlrpclib.Fault(1000, "No such task: %s" % task_id)
+        return task
+
+    # the hub's API
+
+    def rpc_getAPIVersion(self):
+        return 1
+
+    def rpc_getBuildTarget(self, target):
+        return {'id': 1, 'name': target, 'build_tag_name': "%s-build" % target, 'dest_tag_name': target}
+
+    def rpc_getTag(self, tag, **kwargs):
+        return {'id': 1, 'name': tag, 'locked': False, 'arches': ' '.join(self.arches)}
+
+    def rpc_checkTagPackage(self, tag, name):
+        with self.lock:
+            return name in self.tags.get(tag, set())
+
+    def rpc_packageListAdd(self, tag, name, owner=None, **kwargs):
+        with self.lock:
+            self.tags.setdefault(tag, set()).add(name)
+        return None
+
+    def rpc_build(self, src, target, opts=None, priority=None, **kwargs):
+        now = time.time()
+        name = src.split('/')[-1].split('.git')[0]
+        parent = self._new_task('build', [src, target, opts or {}], start=now)
+
+        srpm = self._new_task('buildSRPMFromSCM', [src, 1, {}], parent=parent.id, start=now,
+                duration=self.task_seconds / 2, host_id=random.randint(1, self.hosts))
+        parent.children.append(srpm)
+        fail = random.random() < self.fail_rate
+        for i, arch in enumerate(self.arches):
+            task = self._new_task('buildArch', ["tasks/%s.src.rpm" % name, 1, arch, True, {}], parent=parent.id,
+                    arch=arch, start=srpm.start + srpm.duration, duration=self.task_seconds,
+                    host_id=random.randint(1, self.hosts))
+            parent.children.append(task)
+            # the buildArch stays open until its own child is done
+            repo = self._new_task('createrepo', [1, arch, None], parent=task.id, arch=arch,
+                    start=task.start + self.task_seconds / 2, duration=self.task_seconds / 2,
+                    host_id=task.host_id, fail=fail and i == 0)
+            task.children.append(repo)
+        tag = self._new_task('tagBuild', [1, 1], parent=parent.id, start=now + self.task_seconds * 1.5,
+                duration=self.task_seconds / 4, host_id=random.randint(1, self.hosts))
+        parent.children.append(tag)
+
+        with self.lock:
+            self.builds.append((name, target, parent.id))
+        return parent.id
+
+    def rpc_getTaskInfo(self, task_id, request=False):
+        return self._task(task_id).info(time.time(), request)
+
+    def rpc_getTaskChildren(self, task_id, **kwargs):
+        now = time.time()
+        return [child.info(now) for child in self._task(task_id).children if child.start <= now]
+
+    def rpc_getTaskResult(self, task_id, **kwargs):
+        task = self._task(task_id)
+        if task.state(time.time()) == FAILED:
+            raise xmlrpclib.Fault(1, "GenericError: scripted failure of task %d" % task_id)
+        return None
+
+    def rpc_getRepo(self, tag, **kwargs):
+        count = int((time.time() - self.started) / self.repo_seconds)
+        return {'id': count + 1, 'create_event': count + 1, 'state': 1,
+                'create_ts': self.started + count * self.repo_seconds}
+
+    def rpc_listTaggedRPMS(self, tag, **kwargs):
+        now = time.time()
+        rpms = []
+        builds = []
+        with self.lock:
+            tagged = list(self.builds)
+        for name, target, task_id in tagged:
+            if self.tasks[task_id].state(now) != CLOSED:
+                continue
+            builds.append({'id': task_id, 'package_name': name, 'name': name})
+            for rpm_name in (name, "%s-devel" % name):
+                rpms.append({'name': rpm_name, 'build_id': task_id, 'arch': self.arches[0]})
+        return [rpms, builds]
+
+    def rpc_getHost(self, host_id, **kwargs):
+        return {'id': host_id, 'name': "builder%02d.bench" % host_id}
+
+    def rpc_logout(self):
+        return None
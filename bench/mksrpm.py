@@ -0,0 +1,141 @@
+#!/usr/bin/python
+"""Generate synthetic source rpms for benchmarking skein
+
+Each srpm has a spec, one or more tarballs of random (incompressible) data
+and a number of small patches.  rpmbuild must be installed.
+"""
+
+import os
+import sys
+import shutil
+import tarfile
+import argparse
+import tempfile
+import subprocess
+
+SPEC = """Name:           %(name)s
+Version:        %(version)s
+Release:        %(release)s
+Summary:        Synthetic package %(name)s for skein benchmarks
+License:        MIT
+URL:            http://example.com/%(name)s
+%(sources)s
+%(patches)s
+BuildRequires:  gcc
+%(buildrequires)s
+
+%%description
+Synthetic package generated by bench/mksrpm.py.
+
+%%prep
+%%setup -q
+
+%%build
+
+%%install
+
+%%files
+
+%%changelog
+* Thu Jan 01 1970 skein bench <bench@example.com> - %(version)s-%(release)s
+- generated
+"""
+
+def _tarball(path, top, size):
+    """Write a gzipped tarball holding size bytes of random data under top/"""
+
+    tmp = tempfile.mkdtemp()
+    try:
+        data = os.path.join(tmp, 'data')
+        f = open(data, 'wb')
+        left = size
+        while left > 0:
+            chunk = min(left, 1024 * 1024)
+            f.write(os.urandom(chunk))
+            left -= chunk
+        f.close()
+        tar = tarfile.open(path, 'w:gz')
+        tar.add(data, arcname="%s/data" % top)
+        tar.close()
+    finally:
+        shutil.rmtree(tmp)
+
+def make_srpm(outdir, name, version='1.0', release='1', size=1024 * 1024, patches=2, archives=1,
+        payload='w9.gzdio', buildrequires=()):
+    """Build one synthetic srpm into outdir
+
+    :param str name: package name
+    :param int size: bytes of random data in each tarball
+    :param int patches: number of patches
+    :param int archives: number of tarballs
+    :param str payload: rpm payload io, e.g. w9.gzdio, w6.xzdio or w19.zstdio
+    :param list buildrequires: extra BuildRequires
+    :returns: path to the srpm
+    """
+
+    top = tempfile.mkdtemp(prefix='mksrpm-')
+    try:
+        sources = os.path.join(top, 'SOURCES')
+        specs = os.path.join(top, 'SPECS')
+        os.makedirs(sources)
+        os.makedirs(specs)
+
+        source_lines = []
+        for i in range(archives):
+            tarball = "%s-%s%s.tar.gz" % (name, version, i and "-extra%d" % i or '')
+            _tarball(os.path.join(sources, tarball), "%s-%s" % (name, version), size)
+            source_lines.append("Source%d:        %s" % (i, tarball))
+
+        patch_lines = []
+        for i in range(patches):
+            patch = "%s-%s-fix%d.patch" % (name, version, i)
+            f = open(os.path.join(sources, patch), 'w')
+            f.write("--- a/README\n+++ b/README\n@@ -0,0 +1 @@\n+fix %d\n" % i)
+            f.close()
+            patch_lines.append("Patch%d:         %s" % (i, patch))
+
+        spec = os.path.join(specs, "%s.spec" % name)
+        f = open(spec, 'w')
+        f.write(SPEC % {'name': name, 'version': version, 'release': release,
+                'sources': "\n".join(source_lines), 'patches': "\n".join(patch_lines),
+                'buildrequires': "\n".join(["BuildRequires:  %s" % br for br in buildrequires])})
+        f.close()
+
+        devnull = open(os.devnull, 'w')
+        try:
+            subprocess.check_call(['rpmbuild', '-bs', '--nodeps',
+                    '--define', '_topdir %s' % top,
+                    '--define', '_srcrpmdir %s' % outdir,
+                    '--define', '_source_payload %s' % payload,
+                    '--define', 'dist %{nil}', spec], stdout=devnull)
+        finally:
+            devnull.close()
+    finally:
+        shutil.rmtree(top)
+
+    return os.path.join(outdir, "%s-%s-%s.src.rpm" % (name, version, release))
+
+def main():
+    p = argparse.ArgumentParser(description=u"generate synthetic srpms for skein benchmarks")
+    p.add_argument("outdir", help=u"directory the srpms are written to")
+    p.add_argument("-n", "--count", type=int, default=10, help=u"number of packages")
+    p.add_argument("-s", "--size", type=float, default=1, help=u"MB of data per tarball")
+    p.add_argument("-p", "--patches", type=int, default=2, help=u"patches per package")
+    p.add_argument("-a", "--archives", type=int, default=1, help=u"tarballs per package")
+    p.add_argument("-v", "--versions", type=int, default=1, help=u"versions of each package")
+    p.add_argument("--payload", default='w9.gzdio', help=u"rpm payload io (w9.gzdio, w6.xzdio, w19.zstdio)")
+    p.add_argument("--prefix", default='bench', help=u"package name prefix")
+    args = p.parse_args()
+
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+
+    for i in range(args.count):
+        for v in range(args.versions):
+            path = make_srpm(args.outdir, "%s-pkg%04d" % (args.prefix, i), version="1.%d" % v,
+                    size=int(args.size * 1024 * 1024), patches=args.patches,
+                    archives=args.archives, payload=args.payload)
+            print path
+
+if __name__ == "__main__":
+    sys.exit(main())
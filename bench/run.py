@@ -0,0 +1,265 @@
+#!/usr/bin/python
+"""Benchmark skein end to end against local stand-ins
+
+Generates synthetic srpms, starts a fake koji hub, points the git remote at
+bare repositories (bench/fakegithub.py) and the lookaside at a local
+directory reached through bench/fakessh, then times each phase:
+
+    extract    extract and hash every srpm
+    reextract  the same again, which should skip everything unchanged
+    import     extract, commit, upload and push every srpm
+    push       push every package again, which should be up to date
+    grant      grant a new repo request per package
+    build      submit a build per package and watch the task trees
+
+For each phase it reports wall time, throughput, and the calls made to
+each stand-in (ssh split into connections that needed a handshake and
+those multiplexed over a master), followed by skein's own per stage
+metrics.  rpmbuild, koji,
+rpm-python and GitPython must be installed, as for skein itself.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import ConfigParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, TOP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import mksrpm
+import fakekoji
+import fakegithub
+
+PHASES = ['extract', 'reextract', 'import', 'push', 'grant', 'build']
+
+def write_config(root, args):
+    """Write root/.skein/skein.cfg: conf/skein.cfg pointed at the stand-ins"""
+
+    config = ConfigParser.RawConfigParser()
+    config.read(os.path.join(TOP_DIR, 'conf', 'skein.cfg'))
+
+    defaults = {
+        'home': root,
+        'install_root': os.path.join(root, 'install'),
+        'proj_dir': os.path.join(root, 'proj'),
+        'path': os.path.join(TOP_DIR, 'skein', 'templates'),
+        'editor': '/bin/true',
+        'jobs': str(args.jobs),
+    }
+    for k, v in defaults.items():
+        config.set('DEFAULT', k, v)
+
+    settings = {
+        'git': {'remote_module': 'fakegithub', 'remote_class': 'FakeGithubRemote'},
+        'github': {'anon_base': os.path.join(root, 'remotes')},
+        'bench': {'remote_root': os.path.join(root, 'remotes'), 'github_latency': str(args.github_latency)},
+        'lookaside': {'ssh': os.path.join(root, 'bin', 'ssh'), 'host': 'lookaside.bench',
+                      'user': 'pkgmgr', 'grant_user': 'bench-admin',
+                      'remote_dir': os.path.join(root, 'lookaside'),
+                      'control_path': os.path.join(root, 'ssh-%%r@%%h:%%p')},
+        'koji': {'watch_interval': '0.2', 'watch_max_interval': '1'},
+        'logger': {'file': os.path.join(root, 'skein.log')},
+    }
+    for section, values in settings.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for k, v in values.items():
+            config.set(section, k, v)
+
+    os.makedirs(os.path.join(root, '.skein'))
+    f = open(os.path.join(root, '.skein', 'skein.cfg'), 'w')
+    config.write(f)
+    f.close()
+
+def write_ssh(root, args):
+    """skein runs 'ssh' from the config as a single path, so wrap fakessh"""
+
+    os.makedirs(os.path.join(root, 'bin'))
+    path = os.path.join(root, 'bin', 'ssh')
+    f = open(path, 'w')
+    f.write("#!/bin/sh\nexec %s %s \"$@\"\n" % (sys.executable, os.path.join(BENCH_DIR, 'fakessh')))
+    f.close()
+    os.chmod(path, 0755)
+
+    os.environ['BENCH_SSH_LOG'] = os.path.join(root, 'ssh.log')
+    os.environ['BENCH_SSH_LATENCY'] = str(args.ssh_latency)
+    os.environ['BENCH_LOOKASIDE_DIR'] = os.path.join(root, 'lookaside')
+    os.environ['BENCH_GRANT_USER'] = 'bench-admin'
+
+def ssh_connections(root):
+    """Return (connections that made a handshake, connections multiplexed)"""
+
+    path = os.path.join(root, 'ssh.log')
+    if not os.path.exists(path):
+        return 0, 0
+    kinds = [line.split()[1] for line in open(path)]
+    return kinds.count('new'), kinds.count('mux')
+
+class Phase(object):
+    """Counts from every stand-in, taken before and after a phase"""
+
+    def __init__(self, name, root, hub):
+        self.name = name
+        self.root = root
+        self.hub = hub
+
+    def _snapshot(self):
+        requests, calls = self.hub.stats()
+        new, mux = ssh_connections(self.root)
+        return {'koji_requests': requests, 'koji_calls': sum(calls.values()),
+                'github_calls': sum(fakegithub.calls().values()),
+                'ssh': new, 'ssh_mux': mux, 'time': time.time()}
+
+    def __enter__(self):
+        from skein import metrics
+        metrics.collector = metrics.Metrics()
+        self.before = self._snapshot()
+        return self
+
+    def __exit__(self, *exc):
+        after = self._snapshot()
+        self.delta = dict((k, after[k] - self.before[k]) for k in after)
+        from skein import metrics
+        self.metrics = metrics.collector
+        return False
+
+def main():
+    p = argparse.ArgumentParser(description=u"benchmark skein against local stand-ins for koji, github and the lookaside")
+    p.add_argument("-n", "--count", type=int, default=20, help=u"number of packages")
+    p.add_argument("-s", "--size", type=float, default=4, help=u"MB of data per tarball")
+    p.add_argument("-p", "--patches", type=int, default=4, help=u"patches per package")
+    p.add_argument("--payload", default='w9.gzdio', help=u"rpm payload io (w9.gzdio, w6.xzdio, w19.zstdio)")
+    p.add_argument("-j", "--jobs", type=int, default=4, help=u"skein workers per stage")
+    p.add_argument("--phases", default=','.join(PHASES), help=u"comma separated phases to run (default: all)")
+    p.add_argument("--srpms", metavar="dir", help=u"use the srpms in dir instead of generating them")
+    p.add_argument("--task-seconds", type=float, default=2, help=u"seconds each fake koji task stays open")
+    p.add_argument("--fail-rate", type=float, default=0.0, help=u"fraction of fake builds that fail")
+    p.add_argument("--koji-latency", type=float, default=0.0, help=u"seconds added to each koji request")
+    p.add_argument("--github-latency", type=float, default=0.0, help=u"seconds added to each github call")
+    p.add_argument("--ssh-latency", type=float, default=0.0, help=u"seconds added to each ssh connection")
+    p.add_argument("--root", help=u"work directory (default: a new temporary directory)")
+    p.add_argument("--keep", action="store_true", help=u"keep the work directory")
+    p.add_argument("-v", "--verbose", action="store_true", help=u"show skein's output")
+    args = p.parse_args()
+
+    phases = [phase for phase in args.phases.split(',') if phase]
+    for phase in phases:
+        if phase not in PHASES:
+            p.error("unknown phase '%s', choose from %s" % (phase, ', '.join(PHASES)))
+
+    root = args.root or tempfile.mkdtemp(prefix='skein-bench-')
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    root = os.path.abspath(root)
+
+    # skein reads ~/.skein/skein.cfg, and commits need an identity
+    os.environ['HOME'] = root
+    for var, value in [('GIT_AUTHOR_NAME', 'skein bench'), ('GIT_COMMITTER_NAME', 'skein bench'),
+                       ('GIT_AUTHOR_EMAIL', 'bench@example.com'), ('GIT_COMMITTER_EMAIL', 'bench@example.com')]:
+        os.environ[var] = value
+
+    write_config(root, args)
+    write_ssh(root, args)
+    for d in ['remotes', 'lookaside']:
+        os.makedirs(os.path.join(root, d))
+
+    srpm_dir = args.srpms
+    if not srpm_dir:
+        srpm_dir = os.path.join(root, 'srpms')
+        os.makedirs(srpm_dir)
+        print "Generating %d srpm(s) of %.1fMB with %d patch(es) in %s" % (args.count, args.size, args.patches, srpm_dir)
+        for i in range(args.count):
+            mksrpm.make_srpm(srpm_dir, "bench-pkg%04d" % i, size=int(args.size * 1024 * 1024),
+                    patches=args.patches, payload=args.payload)
+    srpms = [os.path.join(srpm_dir, f) for f in sorted(os.listdir(srpm_dir)) if f.endswith('.src.rpm')]
+    srpm_bytes = sum([os.path.getsize(srpm) for srpm in srpms])
+
+    hub = fakekoji.FakeKojiHub(task_seconds=args.task_seconds, fail_rate=args.fail_rate,
+            latency=args.koji_latency).start()
+
+    import koji
+    import __builtin__
+    from skein.pyskein import PySkein
+    from skein.errors import SkeinError
+
+    ps = PySkein()
+    def _init_koji(user=None, kojiconfig=None, url=None):
+        ps.kojisession = koji.ClientSession(hub.url)
+    ps._init_koji = _init_koji
+    # grant confirms before doing anything
+    __builtin__.raw_input = lambda prompt='': 'y'
+
+    def run(name, func):
+        stdout = sys.stdout
+        if not args.verbose:
+            sys.stdout = open(os.path.join(root, "%s.out" % name), 'w')
+        try:
+            try:
+                func()
+            except SkeinError as e:
+                print >>stdout, "%s: %s" % (name, e.value)
+        finally:
+            if not args.verbose:
+                sys.stdout.close()
+                sys.stdout = stdout
+
+    results = []
+    try:
+        for name in phases:
+            items, nbytes = len(srpms), srpm_bytes
+            with Phase(name, root, hub) as phase:
+                if name == 'extract':
+                    run(name, lambda: ps.do_extract_pkg(argparse.Namespace(path=[srpm_dir], jobs=args.jobs, force=True)))
+                elif name == 'reextract':
+                    run(name, lambda: ps.do_extract_pkg(argparse.Namespace(path=[srpm_dir], jobs=args.jobs, force=False)))
+                elif name == 'import':
+                    run(name, lambda: ps.do_import_pkg(argparse.Namespace(path=[srpm_dir], message='bench import',
+                            jobs=args.jobs, force=True)))
+                elif name == 'push':
+                    nbytes = 0
+                    run(name, lambda: ps.do_push(argparse.Namespace(name=[], all=True, message='bench push', jobs=args.jobs)))
+                elif name == 'grant':
+                    nbytes = 0
+                    fakegithub.add_requests([("bench-grant%04d" % i, 'Synthetic package', 'http://example.com', None)
+                            for i in range(len(srpms))])
+                    run(name, lambda: ps.grant_request(argparse.Namespace(id=[], all=True, jobs=args.jobs, tag=None,
+                            kojiowner=None, gitowner=None, config=None)))
+                elif name == 'build':
+                    nbytes = 0
+                    run(name, lambda: ps.do_build_pkg(argparse.Namespace(target='dist-gl6', name=[], file=None, all=True,
+                            priority=None, tasks_file=None, nowait=False, config=None)))
+            results.append((name, items, nbytes, phase))
+    finally:
+        hub.stop()
+
+    print
+    print "%-10s %6s %9s %9s %8s %10s %10s %8s %6s %7s" % ('phase', 'items', 'seconds', 'items/s', 'MB/s',
+            'koji reqs', 'koji calls', 'github', 'ssh', 'ssh mux')
+    for name, items, nbytes, phase in results:
+        seconds = phase.delta['time']
+        rate = '-'
+        if nbytes and seconds:
+            rate = "%.1f" % (nbytes / seconds / (1024 * 1024))
+        print "%-10s %6d %9.2f %9.1f %8s %10d %10d %8d %6d %7d" % (name, items, seconds, items / max(seconds, 1e-9), rate,
+                phase.delta['koji_requests'], phase.delta['koji_calls'], phase.delta['github_calls'],
+                phase.delta['ssh'], phase.delta['ssh_mux'])
+
+    for name, items, nbytes, phase in results:
+        print
+        print "== %s ==" % name
+        print phase.metrics.report()
+
+    if args.keep or args.root:
+        print
+        print "Work directory kept in %s" % root
+    else:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    sys.exit(main())
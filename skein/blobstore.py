@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+
+class BlobStore(object):
+    """Local content-addressed store of source archives, one copy per sha256
+
+    Archives in the per-package lookaside dirs are hardlinked to their blob
+    (symlinks would be uploaded as links), so a tarball shipped by several
+    packages or versions takes its space once.  Nothing is ever copied or
+    cloned: where a hardlink can't be made, on another filesystem for one,
+    the archive is left as it is.  The store also remembers what has been
+    uploaded to the lookaside host, and under which package.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(root, 'uploaded.db'), check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS uploaded (
+                name TEXT, file TEXT, sha256 TEXT, PRIMARY KEY (name, file))""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS uploaded_sha256 ON uploaded (sha256)")
+        self.db.commit()
+
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def add(self, path, sha256):
+        """Put path in the store, or, if its blob is already there, make path
+        a link to that blob
+
+        :param str path: archive in a package's lookaside dir
+        :param str sha256: hexdigest of path
+        :returns: bytes no longer stored twice
+        """
+
+        with self.lock:
+            return self._add(path, sha256)
+
+    def _add(self, path, sha256):
+        blob = self.path(sha256)
+        if os.path.exists(blob):
+            st, bst = os.stat(path), os.stat(blob)
+            if (st.st_dev, st.st_ino) == (bst.st_dev, bst.st_ino):
+                return 0
+            # link beside path, then rename over it, so path is never missing
+            tmp = "%s.skein-link" % path
+            try:
+                if os.path.lexists(tmp):
+                    os.unlink(tmp)
+                os.link(blob, tmp)
+            except OSError:
+                return 0
+            os.rename(tmp, path)
+            return st.st_size
+
+        d = os.path.dirname(blob)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        try:
+            os.link(path, blob)
+        except OSError:
+            pass
+        return 0
+
+    def uploaded(self, name, src, sha256):
+        """True if src, with this sha256, has been uploaded for package name
+
+        :param str name: package name
+        :param str src: archive file name
+        :param str sha256: hexdigest of the archive
+        """
+
+        with self.lock:
+            row = self.db.execute("SELECT sha256 FROM uploaded WHERE name = ? AND file = ?", (name, src)).fetchone()
+        return row is not None and row[0] == sha256
+
+    def uploaded_elsewhere(self, name, src, sha256):
+        """Names of the other packages src, with this sha256, was uploaded for
+
+        :param str name: package name
+        :param str src: archive file name
+        :param str sha256: hexdigest of the archive
+        """
+
+        with self.lock:
+            rows = self.db.execute("SELECT name FROM uploaded WHERE sha256 = ? AND file = ? AND name != ? ORDER BY name",
+                    (sha256, src, name)).fetchall()
+        return [row[0] for row in rows]
+
+    def set_uploaded(self, name, sums):
+        """Record archives as uploaded for package name
+
+        :param str name: package name
+        :param dict sums: archive file name to sha256
+        """
+
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO uploaded VALUES (?, ?, ?)",
+                    [(name, src, sha256) for src, sha256 in sums.items()])
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import cPickle
+import threading
+import multiprocessing
+
+import rpmfile
+
+def _read(args):
+    # runs in a worker process, so only plain data may come back
+    path, reader = args
+    try:
+        return path, reader(path), None
+    except Exception as e:
+        return path, None, str(e)
+
+class SrpmCatalog(object):
+    """On-disk index of SRPM headers, keyed by path, size and mtime
+
+    Headers are only read from an SRPM that is new to the catalog or has
+    changed since it was last read.  Binary rpms are catalogued the same
+    way, in a table of their own, with table='rpms' and
+    reader=rpmfile.read_provides.
+
+    :param str path: sqlite database
+    :param str table: table the headers are kept in
+    :param reader: module level function reading the details from a path
+    """
+
+    def __init__(self, path, table='srpms', reader=rpmfile.read_header):
+        self.path = path
+        self.table = table
+        self.reader = reader
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS %s (
+                path TEXT PRIMARY KEY, size INTEGER, mtime REAL,
+                name TEXT, version TEXT, release TEXT, info BLOB)""" % table)
+        self.db.execute("CREATE INDEX IF NOT EXISTS %s_name ON %s (name)" % (table, table))
+        self.db.commit()
+
+    def get(self, path):
+        """Return the catalogued details for path, or None if unknown or stale
+
+        :param str path: path to the source RPM (SRPM)
+        """
+
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self.lock:
+            row = self.db.execute("SELECT size, mtime, info FROM %s WHERE path = ?" % self.table, (path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime:
+            return cPickle.loads(str(row[2]))
+        return None
+
+    def put(self, path, rpminfo, st=None):
+        """Catalog the details read from path
+
+        :param str path: path to the source RPM (SRPM)
+        :param dict rpminfo: srpm details from rpmfile.read_header
+        :param st: os.stat result taken before the header was read
+        """
+
+        path = os.path.abspath(path)
+        if st is None:
+            st = os.stat(path)
+        info = sqlite3.Binary(cPickle.dumps(rpminfo, cPickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?, ?, ?, ?)" % self.table,
+                    (path, st.st_size, st.st_mtime, rpminfo['name'], rpminfo['version'], rpminfo['release'], info))
+            self.db.commit()
+
+    def lookup(self, path):
+        """Return the details for path, reading the header only if needed
+
+        :param str path: path to the source RPM (SRPM)
+        """
+
+        rpminfo = self.get(path)
+        if rpminfo is None:
+            st = os.stat(path)
+            rpminfo = self.reader(path)
+            self.put(path, rpminfo, st)
+        return rpminfo
+
+    def scan(self, paths, workers=4):
+        """Bring the catalog up to date for paths, reading stale headers in parallel
+
+        :param list paths: paths to source RPMs (SRPMs)
+        :param int workers: number of header reading processes
+        :returns: tuple of (number of headers read, dict of path to error)
+        """
+
+        stale = [p for p in paths if self.get(p) is None]
+        if not stale:
+            return 0, {}
+
+        stats = dict((p, os.stat(p)) for p in stale)
+        errors = {}
+        if len(stale) == 1 or workers <= 1:
+            results = [_read((p, self.reader)) for p in stale]
+        else:
+            pool = multiprocessing.Pool(min(workers, len(stale)))
+            try:
+                # map_async().get() with a timeout keeps ^C working
+                results = pool.map_async(_read, [(p, self.reader) for p in stale], chunksize=16).get(365 * 86400)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+        for path, rpminfo, error in results:
+            if error:
+                errors[path] = error
+            else:
+                self.put(path, rpminfo, stats[path])
+
+        return len(stale) - len(errors), errors
+
+    def close(self):
+        with self.lock:
+            self.db.close()
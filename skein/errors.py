@@ -0,0 +1,11 @@
+class SkeinError(Exception):
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return str(self.value)
+
+class UnsupportedPayload(SkeinError):
+    """Raised when an SRPM payload can't be streamed directly"""
+    pass
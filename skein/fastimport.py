@@ -0,0 +1,64 @@
+import subprocess
+
+import metrics
+from errors import SkeinError
+
+class FastImport(object):
+    """Write commits straight into a repository through 'git fast-import',
+    without a working tree or index.
+    """
+
+    def __init__(self, repo_dir, ref='refs/heads/master'):
+        self.repo_dir = repo_dir
+        self.ref = ref
+        self.marks = 0
+        metrics.count(subprocesses=1)
+        # with --done, a stream cut short (skein dying mid import) is an
+        # error rather than a commit of whatever had been sent so far
+        self.proc = subprocess.Popen(['git', 'fast-import', '--quiet', '--done'], cwd=repo_dir,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def _data(self, data):
+        self.proc.stdin.write("data %d\n" % len(data))
+        self.proc.stdin.write(data)
+        self.proc.stdin.write("\n")
+
+    def commit(self, committer, message, files, parent=None):
+        """Add a commit whose tree holds exactly files
+
+        :param str committer: 'Name <email> time tz', as from 'git var GIT_COMMITTER_IDENT'
+        :param str message: commit message
+        :param list files: (path, mode, content) tuples
+        :param str parent: commit to start from, only needed for the first
+                           commit when the ref already exists
+        :returns: the mark of the new commit, e.g. ':1'
+        """
+
+        self.marks += 1
+        mark = ":%d" % self.marks
+        self.proc.stdin.write("commit %s\nmark %s\ncommitter %s\n" % (self.ref, mark, committer))
+        self._data(message)
+        if parent:
+            self.proc.stdin.write("from %s\n" % parent)
+        # every file is listed, so whatever the last version had and this
+        # one doesn't is dropped
+        self.proc.stdin.write("deleteall\n")
+        for path, mode, content in files:
+            self.proc.stdin.write("M %o inline %s\n" % (mode, path))
+            self._data(content)
+        self.proc.stdin.write("\n")
+        return mark
+
+    def close(self):
+        """Finish the stream and wait for fast-import to update the ref"""
+
+        out, err = self.proc.communicate("done\n")
+        if self.proc.returncode != 0:
+            raise SkeinError("git fast-import failed in '%s': %s" % (self.repo_dir, err.strip()))
+
+    def abort(self):
+        """Stop fast-import without updating the ref, dropping every commit
+        sent so far"""
+
+        self.proc.kill()
+        self.proc.wait()
@@ -0,0 +1,80 @@
+import os
+import errno
+import fcntl
+import shutil
+
+# from linux/fs.h, clones a whole file on btrfs, XFS and other filesystems
+# that share extents between files
+FICLONE = 0x40049409
+
+def _reflink(src, dest):
+    """Clone src to dest without copying its data, if the filesystem can
+
+    :returns: True if dest was created as a reflink of src
+    """
+
+    s = open(src, 'rb')
+    try:
+        d = open(dest, 'wb')
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return True
+        except (IOError, OSError):
+            return False
+        finally:
+            d.close()
+    finally:
+        s.close()
+
+def place_file(src, dest, move=False):
+    """Put a copy of src at dest, writing as little data as possible
+
+    If move is set src is renamed into place; otherwise, or across
+    filesystems, a reflink is tried, then a hardlink, and only then a plain
+    copy.  dest is always replaced in one rename, and keeps src's mode and
+    times, as shutil.copy2 would.
+
+    :param str src: file to place
+    :param str dest: target file, or directory to place it in
+    :param bool move: src may be moved, it is not needed afterwards
+    :returns: tuple of (method used, bytes not written)
+    """
+
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(src))
+    size = os.path.getsize(src)
+    tmp = os.path.join(os.path.dirname(dest), ".%s.partial" % os.path.basename(dest))
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+
+    if move:
+        try:
+            os.rename(src, dest)
+            return 'rename', size
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+    if _reflink(src, tmp):
+        shutil.copystat(src, tmp)
+        os.rename(tmp, dest)
+        if move:
+            os.unlink(src)
+        return 'reflink', size
+    os.unlink(tmp)
+
+    if not move:
+        # a moved file has no other name to share its inode with
+        try:
+            os.link(src, tmp)
+            os.rename(tmp, dest)
+            return 'hardlink', size
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+
+    shutil.copy2(src, tmp)
+    os.rename(tmp, dest)
+    if move:
+        os.unlink(src)
+    return 'copy', 0
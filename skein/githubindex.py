@@ -0,0 +1,122 @@
+import time
+import sqlite3
+import threading
+
+class GithubIndex(object):
+    """Local sqlite copy of the github data skein looks things up in, so
+    checks like 'has this repo been requested before' don't need a search
+    against the API.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS issues (
+                number INTEGER PRIMARY KEY, name TEXT, title TEXT, state TEXT)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS issues_name ON issues (name)")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS teams (
+                name TEXT PRIMARY KEY, id INTEGER)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS synced (
+                what TEXT PRIMARY KEY, time REAL)""")
+        self.db.commit()
+
+    def synced(self, what):
+        """Return when what was last synced, or None
+
+        :param str what: name of the synced data, e.g. 'issues'
+        """
+
+        with self.lock:
+            row = self.db.execute("SELECT time FROM synced WHERE what = ?", (what,)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def set_synced(self, what, when=None):
+        if when is None:
+            when = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO synced VALUES (?, ?)", (what, when))
+            self.db.commit()
+
+    def put_issues(self, issues):
+        """Add or update issues
+
+        :param list issues: (number, name, title, state) tuples
+        """
+
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?)", issues)
+            self.db.commit()
+
+    def close_missing(self, open_numbers):
+        """Mark every indexed open issue not in open_numbers as closed
+
+        :param list open_numbers: numbers of the issues currently open
+        """
+
+        with self.lock:
+            known = [row[0] for row in self.db.execute("SELECT number FROM issues WHERE state = 'open'")]
+            gone = set(known) - set(open_numbers)
+            self.db.executemany("UPDATE issues SET state = 'closed' WHERE number = ?", [(n,) for n in gone])
+            self.db.commit()
+        return len(gone)
+
+    def find_issues(self, name):
+        """Return (number, title, state) for each issue whose repository name
+        is name, or has it as a whole '-' or '_' separated token, as github's
+        token based issue search would find it, so near duplicates
+        ('python-foo' for 'foo') are caught but 'sed' for 'ed' is not
+
+        :param str name: repository name, matched without regard to case
+        """
+
+        # LIKE is case-insensitive; name's own % and _ are matched literally
+        token = name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        patterns = [token]
+        for sep in ('-', '\\_'):
+            patterns.extend(["%s%s%%" % (token, sep), "%%%s%s" % (sep, token), "%%%s%s%s%%" % (sep, token, sep)])
+        where = " OR ".join(["name LIKE ? ESCAPE '\\'"] * len(patterns))
+        with self.lock:
+            return self.db.execute("SELECT number, title, state FROM issues WHERE %s ORDER BY number" % where,
+                    patterns).fetchall()
+
+    def put_teams(self, teams, replace=False):
+        """Add or update teams
+
+        :param list teams: (name, id) tuples
+        :param bool replace: forget every other team, for a full sync
+        """
+
+        with self.lock:
+            if replace:
+                self.db.execute("DELETE FROM teams")
+            self.db.executemany("INSERT OR REPLACE INTO teams VALUES (?, ?)", teams)
+            self.db.commit()
+
+    def forget_team(self, name):
+        """Drop team name from the index, e.g. once github no longer has it
+
+        :param str name: team name
+        """
+
+        with self.lock:
+            self.db.execute("DELETE FROM teams WHERE name = ?", (name,))
+            self.db.commit()
+
+    def team_id(self, name):
+        """Return the id of team name, or None if it isn't indexed
+
+        :param str name: team name
+        """
+
+        with self.lock:
+            row = self.db.execute("SELECT id FROM teams WHERE name = ?", (name,)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -5,10 +5,6 @@ import time
 import tempfile
 import subprocess
 
-# GitPython
-import git
-from git import InvalidGitRepositoryError, NoSuchPathError, GitCommandError
-
 # settings, including lookaside uri and temporary paths
 from pyskein import SkeinError
 
@@ -16,7 +12,9 @@ from pyskein import SkeinError
 from github2.client import Github
 from github2.request import HttpError
 
+import metrics
 from gitremote import GitRemote
+from githubindex import GithubIndex
 
 
 class GithubRemote(GitRemote):
@@ -27,12 +25,119 @@ class GithubRemote(GitRemote):
         self.cfgs = cfgs
         self.org = self.cfgs['github']['org']
         self.github = self._login()
+        # (call, args) -> (time fetched, result), see _cached
+        self._responses = {}
+        self.cache_ttl = float(self.cfgs['github'].get('cache_ttl', 0))
+        self.index = None
+        self._issues_synced = False
+        self._teams_synced = False
 
     def __str__(self):
         return self.name
 
     def _login(self):
-        return Github(username=self.cfgs['github']['username'], api_token=self.cfgs['github']['api_token'])
+        # with a cache dir, github2 keeps responses on disk and revalidates
+        # them with ETag/If-Modified-Since instead of downloading them again
+        cache_dir = self.cfgs['github'].get('cache_dir')
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0775)
+        github = Github(username=self.cfgs['github']['username'], api_token=self.cfgs['github']['api_token'], cache=cache_dir)
+
+        # every API call, revalidated or not, goes through raw_request
+        raw_request = github.request.raw_request
+        def _counted(*args, **kwargs):
+            metrics.count(rpcs=1)
+            return raw_request(*args, **kwargs)
+        github.request.raw_request = _counted
+
+        return github
+
+    def _cached(self, key, func, *args, **kwargs):
+        """Return func(*args, **kwargs), reusing a result fetched less than
+        cache_ttl seconds ago under the same key
+
+        :param tuple key: identifies the call and its arguments
+        """
+
+        now = time.time()
+        if self._responses.has_key(key):
+            fetched, result = self._responses[key]
+            if now - fetched < self.cache_ttl:
+                return result
+        result = func(*args, **kwargs)
+        self._responses[key] = (now, result)
+        return result
+
+    def _forget(self, *key):
+        """Drop cached results starting with key, after changing them remotely"""
+
+        for k in self._responses.keys():
+            if k[:len(key)] == key:
+                del self._responses[k]
+
+    def _issue_name(self, title):
+        return title[title.find(":")+1:].strip()
+
+    def _sync_issues(self):
+        """Bring the local issue index up to date, once per run.
+
+        Only the open issues are listed each time: issues that dropped off
+        that list were closed.  The closed list, which only grows, is
+        fetched in full every index_full_sync seconds to catch issues
+        opened and closed between syncs.
+        """
+
+        self._index()
+        if self._issues_synced:
+            return self.index
+
+        project = self.cfgs['github']['issue_project']
+        states = ['open']
+        last_full = self.index.synced('issues_closed')
+        if not last_full or time.time() - last_full > float(self.cfgs['github'].get('index_full_sync', 604800)):
+            states.append('closed')
+
+        self.logger.info("  Syncing %s issue index for '%s'" % ('/'.join(states), project))
+        for state in states:
+            issues = self._cached(('issues', state), self.github.issues.list, project, state=state)
+            self.index.put_issues([(i.number, self._issue_name(i.title), i.title, state) for i in issues])
+            if state == 'open':
+                closed = self.index.close_missing([i.number for i in issues])
+                self.logger.debug("  %d indexed issue(s) closed since last sync" % closed)
+            self.index.set_synced('issues_%s' % state)
+
+        self._issues_synced = True
+        return self.index
+
+    def _index(self):
+        if not self.index:
+            self.index = GithubIndex(self.cfgs['github']['index'])
+        return self.index
+
+    def sync_teams(self, force=False):
+        """ Refresh the local team name -> id index from the organization's team list
+
+        Only done once per run, and then only when the index is empty or a
+        team is missing from it, unless force is set.
+
+        :param bool force: refresh even if the index already has teams, or
+                           was already refreshed this run
+        """
+
+        index = self._index()
+        if not force and (self._teams_synced or index.synced('teams')):
+            return index
+
+        self.logger.info("  Syncing team index for '%s'" % self.org)
+        teams = self.github.organizations.teams(self.cfgs['github']['org'])
+        # teams deleted on github go from the index too
+        index.put_teams([(t['name'], t['id']) for t in teams], replace=True)
+        index.set_synced('teams')
+        self._teams_synced = True
+        return index
+
+    def _show_issue(self, request_id):
+        return self._cached(('issue', str(request_id)), self.github.issues.show, self.cfgs['github']['issue_project'], request_id)
 
     def _request_by_editor(self, name):
         """ Set request values with the EDITOR value
@@ -109,16 +214,12 @@ class GithubRemote(GitRemote):
             reason = self._request_from_srpm(summary, url, force)
 
         try:
-            issues = self.github.issues.search(self.cfgs['github']['issue_project'], name, state='open')
-            issues_closed = self.github.issues.search(self.cfgs['github']['issue_project'], name, state='closed')
-
-            issues.extend(issues_closed)
+            index = self._sync_issues()
 
-            for i in issues:
-#            for i in self.github.issues.list_by_label(self.cfgs['github']['issue_project'], self.cfgs['github']['new_repo_issue_label']):
+            for number, title, state in index.find_issues(name):
 
-                print "Possible conflict with request: '%s'" % i.title.split(':')[1].strip()
-                print "%s/%s/%s/%d." % (self.cfgs['github']['url'], self.cfgs['github']['issue_project'], self.cfgs['github']['issues_uri'], i.number)
+                print "Possible conflict with request: '%s'" % self._issue_name(title)
+                print "%s/%s/%s/%d." % (self.cfgs['github']['url'], self.cfgs['github']['issue_project'], self.cfgs['github']['issues_uri'], number)
                 raise SkeinError("Please file this request at %s/%s/%s if you are sure this is not a conflict."
                         % (self.cfgs['github']['url'], self.cfgs['github']['issue_project'], self.cfgs['github']['issues_uri'] ))
 
@@ -126,6 +227,7 @@ class GithubRemote(GitRemote):
             self.github.issues.add_label(self.cfgs['github']['issue_project'], req.number, self.cfgs['github']['new_repo_issue_label'])
 
             if req:
+                index.put_issues([(req.number, name, self.cfgs['github']['issue_title'] % name, 'open')])
                 print "Issue %d created for new repo: %s." % (req.number, name)
                 print "Visit https://github.com/%s/issues/%d to assign or view the issue." % (self.cfgs['github']['issue_project'], req.number)
 
@@ -134,12 +236,10 @@ class GithubRemote(GitRemote):
             # assume repo already exists if this is thrown
             self.logger.debug("  error: %s" %e)
 
-    def search_repo_requests(self, state='open'):
-        self.logger.info("== Searching '%s' github repository requests from '%s' ==" % (state, self.cfgs['github']['issue_project']))
-
+    def _new_repo_issues(self, state):
         newrepo = []
         try:
-            issues = self.github.issues.list(self.cfgs['github']['issue_project'], state=state)
+            issues = self._cached(('issues', state), self.github.issues.list, self.cfgs['github']['issue_project'], state=state)
 
             [newrepo.append(i) for i in issues if self.cfgs['github']['new_repo_issue_label'] in i.labels]
             self.logger.info("  Grabbed %d new repo requests" % (len(newrepo)))
@@ -147,6 +247,21 @@ class GithubRemote(GitRemote):
             # assume repo already exists if this is thrown
             self.logger.debug("  github error: %s" %e)
 
+        return newrepo
+
+    def list_repo_requests(self, state='open'):
+        """ Return the issue numbers of new repo requests
+
+        :param str state: 'open' or 'closed'
+        """
+
+        return [i.number for i in self._new_repo_issues(state)]
+
+    def search_repo_requests(self, state='open'):
+        self.logger.info("== Searching '%s' github repository requests from '%s' ==" % (state, self.cfgs['github']['issue_project']))
+
+        newrepo = self._new_repo_issues(state)
+
         print u"#\tDescription\t\t\t\t\tRequestor\tURL"
         print u"-----------------------------------------------------------------------------"
 
@@ -176,7 +291,7 @@ class GithubRemote(GitRemote):
 
     def show_request_by_id(self, request_id):
         try:
-            request = self.github.issues.show(self.cfgs['github']['issue_project'], request_id)
+            request = self._show_issue(request_id)
 
             return self._get_request_detail(request)
 
@@ -189,6 +304,7 @@ class GithubRemote(GitRemote):
         self.logger.info("== Creating github repository '%s/%s' ==" % (self.org, name))
 
         try:
+            self._forget('repo', name)
             repo = self.github.repos.create(u"%s/%s" % (self.org, name.encode('utf-8')), summary.encode('utf-8'), url.encode('utf-8'))
             self.logger.info("Remote '%s/%s' successfully created" % (self.org, name))
             print "Remote '%s/%s' successfully created" % (self.org, name)
@@ -214,6 +330,9 @@ class GithubRemote(GitRemote):
     def revoke_repo_request(self, request_id, name):
         self.logger.info("== Revoking github repository request '%s/%s' ==" % (self.org, name))
 
+        self._forget('issue', str(request_id))
+        self._forget('issues')
+
         try:
             self.github.issues.add_label(self.cfgs['github']['issue_project'], request_id, self.cfgs['github']['revoked_repo_issue_label'])
             self.github.issues.remove_label(u"%s" % (self.cfgs['github']['issue_project']), request_id, self.cfgs['github']['new_repo_issue_label'])
@@ -231,45 +350,74 @@ class GithubRemote(GitRemote):
         if not githubowner:
             githubowner = self.cfgs['github']['username']
 
-        try:
-            value = self.github.organizations.add_team(self.org, name, permission, repos)
-            team = value['team']
-            self.logger.info("  Team '%s' created with id: '%s'" % (team['name'], team['id']))
-            print "Team '%s' created with id: '%s'" % (team['name'], team['id'])
+        index = self._index()
+        team_id = index.team_id(name)
+        indexed = bool(team_id)
+        if team_id:
+            team = {'name': name, 'id': team_id}
             team_exists = True
-        except (KeyError, RuntimeError) as e:
-            # assume team already exists if this is thrown
-            self.logger.debug("  github error: %s" %e)
             self.logger.info("  Team '%s' already exists" % name)
             print "Team '%s' already exists, skipping" % name
+        else:
+            try:
+                value = self.github.organizations.add_team(self.org, name, permission, repos)
+                team = value['team']
+                index.put_teams([(team['name'], team['id'])])
+                self.logger.info("  Team '%s' created with id: '%s'" % (team['name'], team['id']))
+                print "Team '%s' created with id: '%s'" % (team['name'], team['id'])
+                team_exists = True
+            except (KeyError, RuntimeError) as e:
+                # assume team already exists if this is thrown
+                self.logger.debug("  github error: %s" %e)
+                self.logger.info("  Team '%s' already exists" % name)
+                print "Team '%s' already exists, skipping" % name
 
         if not team:
             self.logger.info("  Checking to see if team '%s' exists" % name)
-            teams = self.github.organizations.teams(self.cfgs['github']['org'])
-            for t in teams:
-                if t['name'] == name:
-                    team = t
-                    team_exists = True
-                    break
+            team_id = self.sync_teams(force=True).team_id(name)
+            if team_id:
+                team = {'name': name, 'id': team_id}
+                team_exists = True
 
         if team_exists:
-            try:
-                self.logger.info("  Adding '%s' to '%s' " % (githubowner, name))
-                self.github.teams.add_member(team['id'], githubowner)
-                print "Added '%s' to team '%s'" % (githubowner, name)
-            except (KeyError, RuntimeError) as e:
-                # assume team already exists if this is thrown
-                self.logger.debug("  github error: %s" %e)
+            added = self._add_member(team, githubowner)
+            if not added and indexed and not self._teams_synced:
+                # an index from an earlier run may name a team since
+                # deleted on github
+                self.logger.info("  Adding to '%s' failed, refreshing the team index" % name)
+                index.forget_team(name)
+                team_id = self.sync_teams(force=True).team_id(name)
+                if not team_id:
+                    self.logger.info("  Team '%s' no longer exists, creating it again" % name)
+                    return self.create_team(name, permission, githubowner, repos)
+                team = {'name': name, 'id': team_id}
+                added = self._add_member(team, githubowner)
+            if not added:
                 self.logger.info("  %s' is already a member of '%s', skipping" % (githubowner, team['name']))
                 print "'%s' is already a member of '%s', skipping" % (githubowner, team['name'])
         else:
             raise SkeinError("Team '%s' does not exists, check skein.log for more information" % name)
 
+    def _add_member(self, team, githubowner):
+        """Add githubowner to team, returning False if github refused"""
+
+        try:
+            self.logger.info("  Adding '%s' to '%s' " % (githubowner, team['name']))
+            self.github.teams.add_member(team['id'], githubowner)
+            print "Added '%s' to team '%s'" % (githubowner, team['name'])
+            return True
+        except (KeyError, RuntimeError) as e:
+            # assume already a member if this is thrown
+            self.logger.debug("  github error: %s" %e)
+            return False
+
     def request_is_open(self, request_id):
-        return self.github.issues.show(self.cfgs['github']['issue_project'], request_id).state == 'open'
+        return self._show_issue(request_id).state == 'open'
 
     def close_repo_request(self, request_id, name):
 
+        self._forget('issue', str(request_id))
+        self._forget('issues')
         try:
             self.github.issues.comment(self.cfgs['github']['issue_project'], request_id, self.cfgs['github']['closing_comment_text'] % name)
             self.github.issues.close(self.cfgs['github']['issue_project'], request_id)
@@ -297,14 +445,14 @@ class GithubRemote(GitRemote):
 
         repo_detail = {}
         try:
-            repo = self.github.repos.show("%s/%s" % (self.cfgs['github']['org'], name))
+            repo = self._cached(('repo', name), self.github.repos.show, "%s/%s" % (self.cfgs['github']['org'], name))
             repo_detail = { 'description': repo.description, 'homepage': repo.homepage, 'url': repo.url, 'created_time': repo.created_at, 'size': repo.size }
         except HttpError:
             raise SkeinError("Unable to locate repository for '%s' at '%s'" % (name, self.cfgs['github']['org']))
 
         commit_detail = {}
         if repo.size and show_commits:
-            commits = self.github.commits.list("%s/%s" % (self.cfgs['github']['org'], name), branch=branch, page=page)
+            commits = self._cached(('commits', name, branch, page), self.github.commits.list, "%s/%s" % (self.cfgs['github']['org'], name), branch=branch, page=page)
 
             for c in commits:
                 commit_detail[c.committed_date.strftime("%Y-%m-%d %H:%M:%s %Z")] = {'id': c.id, 'author': c.author, 'committer': c.committer, 'message': c.message}
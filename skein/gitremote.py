@@ -18,6 +18,9 @@ class GitRemote():
     def search_repo_requests(self, state='open'):
         return self.remote.search_repo_requests(state)
 
+    def list_repo_requests(self, state='open'):
+        return self.remote.list_repo_requests(state)
+
     def show_request_by_id(self, request_id):
         return self.remote.show_request_by_id(request_id)
 
@@ -27,6 +30,9 @@ class GitRemote():
     def create_team(self, name, permission, gitowner, repos):
         return self.remote.create_team(name, permission, gitowner, repos)
 
+    def sync_teams(self, force=False):
+        return self.remote.sync_teams(force)
+
     def request_is_open(self, request_id):
         return self.remote.request_is_open(request_id)
 
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import hashlib
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+# memory used per file being hashed, however large the file is
+CHUNK_SIZE = 1024 * 1024
+
+def sha256_file(path, chunk_size=CHUNK_SIZE):
+    """Return the sha256 hexdigest of a file, read in fixed size chunks
+
+    :param str path: file to hash
+    :param int chunk_size: bytes read at a time
+    """
+
+    h = hashlib.sha256()
+    f = open(path, 'rb')
+    try:
+        data = f.read(chunk_size)
+        while data:
+            # hashlib releases the GIL for large updates
+            h.update(data)
+            data = f.read(chunk_size)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+class HashCache(object):
+    """Persistent sha256 cache keyed by (device, inode, size, mtime)
+
+    A file that hasn't been touched since it was last hashed is never
+    read again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS hashes (
+                dev INTEGER, ino INTEGER, size INTEGER, mtime REAL, sha256 TEXT,
+                PRIMARY KEY (dev, ino))""")
+        self.db.commit()
+
+    def _key(self, st):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+    def get(self, path):
+        """Return the cached sha256 for path, or None if unknown or stale
+
+        :param str path: file to look up
+        """
+
+        dev, ino, size, mtime = self._key(os.stat(path))
+        with self.lock:
+            row = self.db.execute("SELECT size, mtime, sha256 FROM hashes WHERE dev = ? AND ino = ?",
+                    (dev, ino)).fetchone()
+        if row and row[0] == size and row[1] == mtime:
+            return row[2]
+        return None
+
+    def put(self, path, sha256, st=None):
+        """Remember the sha256 of path
+
+        :param str path: file that was hashed
+        :param str sha256: hexdigest of the file
+        :param st: os.stat result taken before hashing, so a file changed
+                   while being read is not cached under its new mtime
+        """
+
+        if st is None:
+            st = os.stat(path)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+                    self._key(st) + (sha256,))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def hash_files(paths, cache=None, workers=4):
+    """Hash several files concurrently, using and updating cache
+
+    :param list paths: files to hash
+    :param HashCache cache: optional persistent cache
+    :param int workers: number of hashing threads
+    :returns: dict of path to sha256 hexdigest
+    """
+
+    sums = {}
+    todo = []
+    for path in paths:
+        sha256 = cache and cache.get(path)
+        if sha256:
+            sums[path] = sha256
+        else:
+            todo.append(path)
+
+    def _hash(path):
+        st = os.stat(path)
+        sha256 = sha256_file(path)
+        if cache:
+            cache.put(path, sha256, st)
+        return path, sha256
+
+    if len(todo) == 1:
+        sums.update([_hash(todo[0])])
+    elif todo:
+        pool = ThreadPool(min(workers, len(todo)))
+        try:
+            sums.update(pool.map(_hash, todo))
+        finally:
+            pool.close()
+            pool.join()
+
+    return sums
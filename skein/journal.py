@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import threading
+
+class Journal(object):
+    """Append-only record of the stages each srpm has completed
+
+    Every completion is written as one JSON line and synced to disk before
+    the next stage starts, so after a crash the journal says exactly what
+    finished.  A 'start' record forgets what earlier runs did for an srpm.
+    Entries are keyed by the srpm's path and digest, so an srpm replaced
+    since is started over.  After a run with no failures, compact() drops
+    the srpms it finished, so the journal only ever holds unfinished work.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.names = {}
+        if os.path.exists(path):
+            self._load()
+        self.f = open(path, 'a')
+
+    def _key(self, srpm, digest):
+        return (os.path.abspath(srpm), digest)
+
+    def _load(self):
+        f = open(self.path)
+        try:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash
+                    continue
+                key = self._key(entry['srpm'], entry['digest'])
+                self.names[key] = entry['name']
+                if entry['stage'] == 'start':
+                    self.stages[key] = set()
+                else:
+                    self.stages.setdefault(key, set()).add(entry['stage'])
+        finally:
+            f.close()
+
+    def _line(self, srpm, digest, name, stage):
+        return json.dumps({'time': time.time(), 'srpm': os.path.abspath(srpm), 'digest': digest,
+                'name': name, 'stage': stage}, sort_keys=True) + "\n"
+
+    def record(self, srpm, digest, name, stage):
+        """Note that srpm completed stage
+
+        :param str srpm: path to the source rpm
+        :param str digest: srpm digest, from its header
+        :param str name: package name
+        :param str stage: stage name, or 'start' to forget earlier runs
+        """
+
+        line = self._line(srpm, digest, name, stage)
+        key = self._key(srpm, digest)
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.names[key] = name
+            if stage == 'start':
+                self.stages[key] = set()
+            else:
+                self.stages.setdefault(key, set()).add(stage)
+
+    def completed(self, srpm, digest):
+        """Return the set of stages srpm has completed since it was last started
+
+        :param str srpm: path to the source rpm
+        :param str digest: srpm digest, from its header
+        """
+
+        with self.lock:
+            return set(self.stages.get(self._key(srpm, digest), ()))
+
+    def compact(self, finished):
+        """Rewrite the journal without the srpms in finished, keeping only a
+        'start' and one line per completed stage for every other srpm
+
+        :param list finished: (srpm, digest) pairs of the srpms a run finished
+        :returns: number of unfinished srpms kept
+        """
+
+        drop = set([self._key(srpm, digest) for srpm, digest in finished])
+        with self.lock:
+            for key in drop:
+                self.stages.pop(key, None)
+                self.names.pop(key, None)
+
+            tmp = "%s.tmp" % self.path
+            f = open(tmp, 'w')
+            try:
+                for (srpm, digest), stages in sorted(self.stages.items()):
+                    name = self.names.get((srpm, digest))
+                    f.write(self._line(srpm, digest, name, 'start'))
+                    for stage in sorted(stages):
+                        f.write(self._line(srpm, digest, name, stage))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+
+            self.f.close()
+            os.rename(tmp, self.path)
+            self.f = open(self.path, 'a')
+            return len(self.stages)
+
+    def close(self):
+        with self.lock:
+            self.f.close()
@@ -0,0 +1,283 @@
+import sys
+import time
+import heapq
+import logging
+
+import koji
+import xmlrpclib
+
+import metrics
+
+# Add a class stolen from /usr/bin/koji to watch tasks
+# this was cut/pasted from koji, and then modified for local use.
+# The formatting is koji style, not the stile of this file.  Do not use these
+# functions as a style guide.
+# This is fragile and hopefully will be replaced by a real kojiclient lib.
+class TaskWatcher(object):
+
+    def __init__(self,task_id,session,level=0,quiet=False,hosts=None):
+        self.id = task_id
+        self.session = session
+        self.info = None
+        self.level = level
+        self.quiet = quiet
+        # host id -> name, shared between watchers so each host is looked up once
+        if hosts is None:
+            hosts = {}
+        self.hosts = hosts
+        self.logger = logging.getLogger('skein')
+
+    #XXX - a bunch of this stuff needs to adapt to different tasks
+
+    def str(self):
+        if self.info:
+            label = koji.taskLabel(self.info)
+            return "%s%d %s" % ('  ' * self.level, self.id, label)
+        else:
+            return "%s%d" % ('  ' * self.level, self.id)
+
+    def __str__(self):
+        return self.str()
+
+    def get_failure(self):
+        """Print infomation about task completion"""
+        if self.info['state'] != koji.TASK_STATES['FAILED']:
+            return ''
+        error = None
+        try:
+            metrics.count(rpcs=1)
+            result = self.session.getTaskResult(self.id)
+        except (xmlrpclib.Fault,koji.GenericError),e:
+            error = e
+        if error is None:
+            # print "%s: complete" % self.str()
+            # We already reported this task as complete in update()
+            return ''
+        else:
+            return '%s: %s' % (error.__class__.__name__, str(error).strip())
+
+    def update(self, info=None):
+        """Update info and log if needed.  Returns True on state change.
+
+        info may be passed in when it was already fetched in a multicall."""
+        if self.is_done():
+            # Already done, nothing else to report
+            return False
+        last = self.info
+        if info is None:
+            metrics.count(rpcs=1)
+            info = self.session.getTaskInfo(self.id, request=True)
+        self.info = info
+        if self.info is None:
+            self.logger.error("No such task id: %i" % self.id)
+            print "No such task id: %i" % self.id
+            sys.exit(1)
+        state = self.info['state']
+        if last:
+            #compare and note status changes
+            laststate = last['state']
+            if laststate != state:
+                msg = "%s: %s -> %s" % (self.str(), self.display_state(last), self.display_state(self.info))
+                self.logger.info(msg)
+                # failures are shown even when quiet
+                if not self.quiet or state == koji.TASK_STATES['FAILED']:
+                    print msg
+                return True
+            return False
+        else:
+            # First time we're seeing this task, so just show the current state
+            self.logger.info("%s: %s" % (self.str(), self.display_state(self.info)))
+            if not self.quiet:
+                print "%s: %s" % (self.str(), self.display_state(self.info))
+            return False
+
+    def is_done(self):
+        if self.info is None:
+            return False
+        state = koji.TASK_STATES[self.info['state']]
+        return (state in ['CLOSED','CANCELED','FAILED'])
+
+    def is_success(self):
+        if self.info is None:
+            return False
+        state = koji.TASK_STATES[self.info['state']]
+        return (state == 'CLOSED')
+
+    def display_state(self, info):
+        # We can sometimes be passed a task that is not yet open, but
+        # not finished either.  info would be none.
+        if not info:
+            return 'unknown'
+        if info['state'] == koji.TASK_STATES['OPEN']:
+            if info['host_id']:
+                if not self.hosts.has_key(info['host_id']):
+                    metrics.count(rpcs=1)
+                    self.hosts[info['host_id']] = self.session.getHost(info['host_id'])['name']
+                return 'open (%s)' % self.hosts[info['host_id']]
+            else:
+                return 'open'
+        elif info['state'] == koji.TASK_STATES['FAILED']:
+            return 'FAILED: %s' % self.get_failure()
+        else:
+            return koji.TASK_STATES[info['state']].lower()
+
+class TreeWatcher(object):
+    """Follow many koji task trees from a single thread
+
+    Each task is polled on its own schedule: every time it changes state
+    it is polled again after min_interval, and each poll that finds it
+    unchanged doubles the wait, up to max_interval.  Due tasks are polled
+    together, at most max_calls calls per round trip and one round trip in
+    flight, so a mass rebuild costs the hub little more than a single build.
+
+    :param multicall: callable taking (method, args, kwargs) tuples and
+                      returning their results, e.g. PySkein._koji_multicall
+    :param session: koji.ClientSession, used by TaskWatcher for failures
+    :param int max_calls: most calls in one round trip
+    :param float min_interval: seconds between polls of a changing task
+    :param float max_interval: longest wait between polls of a task
+    :param float status_interval: seconds between status lines
+    :param bool quiet: only show the state changes of top level tasks
+                       (and any failure), not those of their children
+    """
+
+    def __init__(self, multicall, session, max_calls=100, min_interval=1, max_interval=30,
+            status_interval=10, quiet=False):
+        self.multicall = multicall
+        self.session = session
+        self.max_calls = max(2, int(max_calls))
+        self.min_interval = float(min_interval)
+        self.max_interval = float(max_interval)
+        self.status_interval = float(status_interval)
+        self.quiet = quiet
+        self.logger = logging.getLogger('skein')
+
+        self.hosts = {}
+        self.tasks = {}
+        self.top = []
+        self.intervals = {}
+        self.queue = []
+        self.rpcs = 0
+
+    def add(self, task_id, level=0):
+        if self.tasks.has_key(task_id):
+            return
+        self.tasks[task_id] = TaskWatcher(task_id, self.session, level, quiet=self.quiet and level > 0, hosts=self.hosts)
+        if level == 0:
+            self.top.append(task_id)
+        self.intervals[task_id] = self.min_interval
+        heapq.heappush(self.queue, (0, task_id))
+
+    def _due(self, now):
+        """Pop the tasks due for a poll, as many as fit in one round trip"""
+
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            # each task costs two calls, its info and its children
+            if due and (len(due) + 1) * 2 > self.max_calls:
+                break
+            due.append(heapq.heappop(self.queue)[1])
+        return due
+
+    def poll(self, now=None):
+        """Poll every due task in one round trip (two, if there are new hosts)
+
+        :returns: number of tasks whose state changed
+        """
+
+        if now is None:
+            now = time.time()
+        due = self._due(now)
+        if not due:
+            return 0
+
+        # only unfinished tasks are ever due, and any of them, at any
+        # depth, may spawn children
+        calls = [('getTaskInfo', (task_id,), {'request': True}) for task_id in due]
+        calls.extend([('getTaskChildren', (task_id,), {}) for task_id in due])
+        results = self.multicall(calls)
+        self.rpcs += 1
+        infos = dict(zip(due, results[:len(due)]))
+        children = dict(zip(due, results[len(due):]))
+
+        host_ids = list(set([info['host_id'] for info in infos.values()
+                if info and info['host_id'] and not self.hosts.has_key(info['host_id'])]))
+        if host_ids:
+            for host_id, host in zip(host_ids, self.multicall([('getHost', (host_id,), {}) for host_id in host_ids])):
+                self.hosts[host_id] = host['name']
+            self.rpcs += 1
+
+        changed = 0
+        for task_id in due:
+            task = self.tasks[task_id]
+            moved = task.update(infos[task_id])
+            for child in children.get(task_id, []):
+                if not self.tasks.has_key(child['id']):
+                    self.add(child['id'], task.level + 1)
+                    moved = True
+            if moved:
+                changed += 1
+                self.intervals[task_id] = self.min_interval
+            else:
+                self.intervals[task_id] = min(self.intervals[task_id] * 2, self.max_interval)
+            if not task.is_done():
+                heapq.heappush(self.queue, (now + self.intervals[task_id], task_id))
+        return changed
+
+    def counts(self, ids=None):
+        """Return a dict of state name to number of tasks in it"""
+
+        counts = {}
+        for task_id in ids is None and self.tasks.keys() or ids:
+            info = self.tasks[task_id].info
+            if info is None:
+                state = 'unknown'
+            else:
+                state = koji.TASK_STATES[info['state']].lower()
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def status(self):
+        """One line summary of the top level tasks and all their children"""
+
+        def _fmt(counts):
+            return ', '.join(["%d %s" % (counts[state], state) for state in sorted(counts.keys())])
+        return "builds: %s | tasks: %s | %d round trips" % (_fmt(self.counts(self.top)), _fmt(self.counts()), self.rpcs)
+
+    def done(self):
+        return not [task for task in self.tasks.values() if not task.is_done()]
+
+    def failed(self):
+        return [task for task in self.tasks.values() if task.is_done() and not task.is_success()]
+
+    def run(self):
+        """Poll until every task is done, printing a status line every
+        status_interval seconds
+
+        :returns: 0 if every task in every tree succeeded, 1 otherwise
+        """
+
+        last_status = time.time()
+        while not self.done():
+            self.poll()
+            now = time.time()
+            if now - last_status >= self.status_interval:
+                msg = self.status()
+                self.logger.info(msg)
+                print msg
+                last_status = now
+            if self.queue:
+                # sleep until the next task is due
+                time.sleep(max(0, min(self.queue[0][0] - time.time(), self.max_interval)))
+
+        msg = self.status()
+        self.logger.info(msg)
+        print msg
+        if self.failed():
+            return 1
+        return 0
+
+    def running(self):
+        """Describe every task still running, for when watching is interrupted"""
+
+        return '\n'.join(['%s: %s' % (t.str(), t.display_state(t.info)) for t in self.tasks.values() if not t.is_done()])
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import threading
+
+from contextlib import contextmanager
+
+class Span(object):
+    """Work done for one package in one stage"""
+
+    def __init__(self, package, stage):
+        self.package = package
+        self.stage = stage
+        self.start = time.time()
+        self.duration = 0.0
+        self.bytes = 0
+        self.subprocesses = 0
+        self.rpcs = 0
+        self.error = None
+
+    def to_dict(self):
+        return {'package': self.package, 'stage': self.stage, 'start': self.start,
+                'duration': self.duration, 'bytes': self.bytes,
+                'subprocesses': self.subprocesses, 'rpcs': self.rpcs, 'error': self.error}
+
+class Metrics(object):
+    """Collects spans for a run of skein
+
+    Counts are added to the innermost span open on the calling thread, so
+    code deep inside a stage (running git, calling koji) can report what it
+    did without knowing which package it is working on.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.spans = []
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def span(self, package, stage):
+        """Time the enclosed block as the work of package in stage
+
+        :param str package: package name
+        :param str stage: stage name, e.g. 'extract'
+        """
+
+        span = Span(package, stage)
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = str(e)
+            raise
+        finally:
+            span.duration = time.time() - span.start
+            stack.pop()
+            with self.lock:
+                self.spans.append(span)
+
+    def count(self, bytes=0, subprocesses=0, rpcs=0):
+        """Add to the counts of the calling thread's current span, if any"""
+
+        stack = self._stack()
+        if stack:
+            span = stack[-1]
+            span.bytes += bytes
+            span.subprocesses += subprocesses
+            span.rpcs += rpcs
+
+    def summary(self):
+        """Totals per stage
+
+        :returns: list of (stage, dict of runs, failed, seconds, max, bytes,
+                  subprocesses and rpcs), in the order stages first ran
+        """
+
+        stages = []
+        totals = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in sorted(spans, key=lambda s: s.start):
+            if not totals.has_key(span.stage):
+                stages.append(span.stage)
+                totals[span.stage] = {'runs': 0, 'failed': 0, 'seconds': 0.0, 'max': 0.0,
+                        'bytes': 0, 'subprocesses': 0, 'rpcs': 0}
+            t = totals[span.stage]
+            t['runs'] += 1
+            if span.error:
+                t['failed'] += 1
+            t['seconds'] += span.duration
+            t['max'] = max(t['max'], span.duration)
+            t['bytes'] += span.bytes
+            t['subprocesses'] += span.subprocesses
+            t['rpcs'] += span.rpcs
+        return [(stage, totals[stage]) for stage in stages]
+
+    def report(self):
+        """Format the per stage summary as a table"""
+
+        lines = ["%-10s %6s %6s %10s %9s %12s %8s %6s" % ('stage', 'runs', 'failed', 'seconds', 'max', 'MB/s', 'procs', 'rpcs')]
+        for stage, t in self.summary():
+            rate = '-'
+            if t['bytes'] and t['seconds']:
+                rate = "%.1f" % (t['bytes'] / t['seconds'] / (1024 * 1024))
+            lines.append("%-10s %6d %6d %10.2f %9.2f %12s %8d %6d" % (stage, t['runs'], t['failed'],
+                    t['seconds'], t['max'], rate, t['subprocesses'], t['rpcs']))
+        return "\n".join(lines)
+
+    def write_jsonl(self, path):
+        """Append one JSON line per span to path"""
+
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        f = open(path, 'a')
+        try:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), sort_keys=True) + "\n")
+        finally:
+            f.close()
+
+    def write_prometheus(self, path):
+        """Write the per stage totals as a Prometheus textfile, replacing path
+        in one rename so a collector never reads half of it"""
+
+        # each file describes one run, so these are gauges
+        metrics = [('runs', 'skein_stage_runs', 'Packages run through the stage'),
+                   ('failed', 'skein_stage_failures', 'Packages that failed in the stage'),
+                   ('seconds', 'skein_stage_seconds', 'Seconds spent in the stage'),
+                   ('bytes', 'skein_stage_bytes', 'Bytes processed by the stage'),
+                   ('subprocesses', 'skein_stage_subprocesses', 'Subprocesses started by the stage'),
+                   ('rpcs', 'skein_stage_rpcs', 'Remote calls made by the stage')]
+        summary = self.summary()
+
+        tmp = "%s.partial" % path
+        f = open(tmp, 'w')
+        try:
+            for key, name, help in metrics:
+                f.write("# HELP %s %s in the last run\n# TYPE %s gauge\n" % (name, help, name))
+                for stage, t in summary:
+                    f.write("%s{stage=\"%s\"} %s\n" % (name, stage, t[key]))
+            f.write("# HELP skein_last_run_timestamp_seconds When the run finished\n")
+            f.write("# TYPE skein_last_run_timestamp_seconds gauge\n")
+            f.write("skein_last_run_timestamp_seconds %f\n" % time.time())
+        finally:
+            f.close()
+        os.rename(tmp, path)
+
+    def write(self, path):
+        """Write the run's metrics to path, as a Prometheus textfile if it
+        ends in .prom and as JSON lines otherwise"""
+
+        if path.endswith('.prom'):
+            self.write_prometheus(path)
+        else:
+            self.write_jsonl(path)
+
+# shared by everything in a run of skein
+collector = Metrics()
+
+def span(package, stage):
+    return collector.span(package, stage)
+
+def count(bytes=0, subprocesses=0, rpcs=0):
+    collector.count(bytes, subprocesses, rpcs)
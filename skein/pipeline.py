@@ -0,0 +1,182 @@
+import Queue
+import logging
+import threading
+
+import metrics
+
+class ImportJob(object):
+    """A single SRPM moving through the import pipeline.
+
+    Everything a stage learns about the package is kept on the job, so
+    stages never share state through the PySkein instance.
+    """
+
+    def __init__(self, srpm):
+        self.srpm = srpm
+        self.rpminfo = None
+        self.proj_dir = None
+        self.src_dest = None
+        self.git_dest = None
+        self.message = None
+        self.repo = None
+        self.force = False
+        self.skipped = False
+        self.resume = False
+        # stages a previous run already completed, from the journal
+        self.resumed = set()
+        self.error = None
+        self.completed = []
+
+    def __str__(self):
+        if self.rpminfo:
+            return self.rpminfo['name']
+        return self.srpm
+
+    @property
+    def name(self):
+        if self.rpminfo:
+            return self.rpminfo['name']
+        return None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+class Stage(object):
+    """A named pipeline step, run by a bounded pool of worker threads
+
+    :param str name: stage name, used in logs and on the job
+    :param func: callable taking an ImportJob
+    :param int workers: number of worker threads for this stage
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+
+class Pipeline(object):
+    """Run jobs through a chain of stages.
+
+    Every stage has its own worker pool and a bounded input queue, so a
+    slow stage (an upload, say) applies back pressure to the stages before
+    it while still letting them work on the next jobs.  A job that fails
+    in one stage, or that a stage marks as skipped, is passed through the
+    remaining stages untouched.
+
+    Jobs sharing the same key (the package name, once it is known) are
+    serialized from the second stage on, so two versions of a package
+    never write to the same directories at once.
+
+    Stages named in a job's resumed set are passed over, and on_complete,
+    if given, is called with the job and stage name after every stage a
+    job completes.
+    """
+
+    def __init__(self, stages, logger=None, key=None, on_complete=None):
+        self.stages = stages
+        self.logger = logger or logging.getLogger('skein')
+        self.key = key
+        self.on_complete = on_complete
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._held = {}
+        self._done = []
+        self._done_lock = threading.Lock()
+
+    def _lock_for(self, job):
+        k = self.key(job)
+        with self._locks_lock:
+            if not self._locks.has_key(k):
+                self._locks[k] = threading.Lock()
+            return self._locks[k]
+
+    def _finish(self, job):
+        lock = self._held.pop(id(job), None)
+        if lock:
+            lock.release()
+        with self._done_lock:
+            self._done.append(job)
+
+    def _work(self, index, inq, outq, remaining):
+        stage = self.stages[index]
+        while True:
+            job = inq.get()
+            if job is None:
+                break
+
+            if not job.failed and not job.skipped:
+                if index == 1 and self.key and self.key(job) is not None:
+                    lock = self._lock_for(job)
+                    lock.acquire()
+                    self._held[id(job)] = lock
+                try:
+                    if stage.name in job.resumed:
+                        self.logger.info("  %s completed '%s' in an earlier run" % (job, stage.name))
+                        job.completed.append(stage.name)
+                    else:
+                        with metrics.span(job.name or job.srpm, stage.name):
+                            stage.func(job)
+                        job.completed.append(stage.name)
+                        if self.on_complete:
+                            self.on_complete(job, stage.name)
+                except Exception as e:
+                    job.error = (stage.name, e)
+                    self.logger.error("  %s failed in stage '%s': %s" % (job, stage.name, e))
+                    print "%s failed in stage '%s': %s" % (job, stage.name, e)
+
+            if outq is None:
+                self._finish(job)
+            else:
+                outq.put(job)
+
+        # the last worker out of a stage closes the next stage's queue
+        with remaining[index]['lock']:
+            remaining[index]['count'] -= 1
+            last = remaining[index]['count'] == 0
+        if last and outq is not None:
+            for i in range(self.stages[index + 1].workers):
+                outq.put(None)
+
+    def _put(self, q, item):
+        # a blocking put without a timeout can't be interrupted by ^C
+        while True:
+            try:
+                q.put(item, True, 0.5)
+                return
+            except Queue.Full:
+                pass
+
+    def run(self, jobs):
+        """Push jobs through every stage and wait for them to finish
+
+        :param list jobs: ImportJob objects
+        :returns: the jobs, in completion order
+        """
+
+        queues = [Queue.Queue(maxsize=s.workers * 2) for s in self.stages]
+        remaining = [{'count': s.workers, 'lock': threading.Lock()} for s in self.stages]
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            outq = None
+            if index + 1 < len(queues):
+                outq = queues[index + 1]
+            for i in range(stage.workers):
+                t = threading.Thread(target=self._work, name="%s-%d" % (stage.name, i),
+                        args=(index, queues[index], outq, remaining))
+                t.setDaemon(True)
+                t.start()
+                threads.append(t)
+
+        for job in jobs:
+            self._put(queues[0], job)
+        for i in range(self.stages[0].workers):
+            self._put(queues[0], None)
+
+        # join with a timeout so ^C still reaches the main thread
+        for t in threads:
+            while t.isAlive():
+                t.join(0.5)
+
+        return self._done
@@ -0,0 +1,68 @@
+def build_requires(rpminfo):
+    """The BuildRequires of an srpm that a package could satisfy
+
+    rpmlib(...) requirements are met by rpm itself in every buildroot.
+
+    :param dict rpminfo: srpm details from rpmfile.read_header
+    :returns: set of required capability names
+    """
+
+    return set([req for req in rpminfo['buildrequires'] if not req.startswith('rpmlib(')])
+
+class ProvidesIndex(object):
+    """Which source packages provide each capability
+
+    Capabilities are names only, as rpm lists BuildRequires without their
+    versions.  Requirements are resolved in bulk, as set operations
+    against the index, rather than by looking each one up.
+    """
+
+    def __init__(self):
+        self.provides = {}
+
+    def __len__(self):
+        return len(self.provides)
+
+    def add(self, source, capabilities):
+        """Record that source package source provides capabilities
+
+        :param str source: source package name
+        :param list capabilities: capability names, including package names
+        """
+
+        for capability in capabilities:
+            self.provides.setdefault(capability, set()).add(source)
+
+    def providers(self, capability):
+        """Return the set of source packages that provide capability"""
+
+        return self.provides.get(capability, set())
+
+    def resolve(self, requires):
+        """Split requires into what the index satisfies and what it doesn't
+
+        :param set requires: required capability names
+        :returns: tuple of (dict of satisfied capability to its providers,
+                  set of missing capabilities)
+        """
+
+        requires = set(requires)
+        satisfied = requires.intersection(self.provides)
+        return dict((req, self.provides[req]) for req in satisfied), requires - satisfied
+
+    def resolve_all(self, requires):
+        """Resolve the requirements of many packages at once: every distinct
+        requirement is looked up once, in a single set difference
+
+        :param dict requires: package to set of required capability names
+        :returns: tuple of (dict of package to set of satisfied capabilities,
+                  dict of package to set of missing capabilities)
+        """
+
+        missing = set().union(*requires.values()).difference(self.provides)
+        satisfied = {}
+        unsatisfied = {}
+        for name, reqs in requires.items():
+            unsatisfied[name] = reqs & missing
+            satisfied[name] = reqs - unsatisfied[name]
+        return satisfied, unsatisfied
@@ -1,137 +1,35 @@
 # Main class for pycamps
 
+# rpm, koji and GitPython are slow to import, so they are imported by the
+# methods that use them; 'skein -h' and friends never load them.
+
 import os
-import re
 import sys
-import rpm
-import time
+import json
 import glob
-import stat
-import shutil
-import hashlib
+import pipes
 import logging
 import tempfile
-import argparse
+import threading
 import subprocess
 import ConfigParser
 
-from urllib2 import HTTPError
-
-import koji
-import xmlrpclib
-
-# GitPython
-import git
-from git import InvalidGitRepositoryError, NoSuchPathError, GitCommandError
+from errors import SkeinError, UnsupportedPayload
 
 # settings, including lookaside uri and temporary paths
 from gitremote import GitRemote
 
-class SkeinError(Exception):
-
-    def __init__(self, value):
-        self.value = value
-
-    def __str__(self):
-        repr(self.value)
-
-# Add a class stolen from /usr/bin/koji to watch tasks
-# this was cut/pasted from koji, and then modified for local use.
-# The formatting is koji style, not the stile of this file.  Do not use these
-# functions as a style guide.
-# This is fragile and hopefully will be replaced by a real kojiclient lib.
-class TaskWatcher(object):
-
-    def __init__(self,task_id,session,level=0,quiet=False):
-        self.id = task_id
-        self.session = session
-        self.info = None
-        self.level = level
-        self.quiet = quiet
-        self.logger = logging.getLogger('skein')
-
-    #XXX - a bunch of this stuff needs to adapt to different tasks
-
-    def str(self):
-        if self.info:
-            label = koji.taskLabel(self.info)
-            return "%s%d %s" % ('  ' * self.level, self.id, label)
-        else:
-            return "%s%d" % ('  ' * self.level, self.id)
-
-    def __str__(self):
-        return self.str()
-
-    def get_failure(self):
-        """Print infomation about task completion"""
-        if self.info['state'] != koji.TASK_STATES['FAILED']:
-            return ''
-        error = None
-        try:
-            result = self.session.getTaskResult(self.id)
-        except (xmlrpclib.Fault,koji.GenericError),e:
-            error = e
-        if error is None:
-            # print "%s: complete" % self.str()
-            # We already reported this task as complete in update()
-            return ''
-        else:
-            return '%s: %s' % (error.__class__.__name__, str(error).strip())
-
-    def update(self):
-        """Update info and log if needed.  Returns True on state change."""
-        if self.is_done():
-            # Already done, nothing else to report
-            return False
-        last = self.info
-        self.info = self.session.getTaskInfo(self.id, request=True)
-        if self.info is None:
-            self.logger.error("No such task id: %i" % self.id)
-            print "No such task id: %i" % self.id
-            sys.exit(1)
-        state = self.info['state']
-        if last:
-            #compare and note status changes
-            laststate = last['state']
-            if laststate != state:
-                msg = "%s: %s -> %s" % (self.str(), self.display_state(last), self.display_state(self.info))
-                self.logger.info(msg)
-                print msg
-                return True
-            return False
-        else:
-            # First time we're seeing this task, so just show the current state
-            self.logger.info("%s: %s" % (self.str(), self.display_state(self.info)))
-            print "%s: %s" % (self.str(), self.display_state(self.info))
-            return False
-
-    def is_done(self):
-        if self.info is None:
-            return False
-        state = koji.TASK_STATES[self.info['state']]
-        return (state in ['CLOSED','CANCELED','FAILED'])
-
-    def is_success(self):
-        if self.info is None:
-            return False
-        state = koji.TASK_STATES[self.info['state']]
-        return (state == 'CLOSED')
-
-    def display_state(self, info):
-        # We can sometimes be passed a task that is not yet open, but
-        # not finished either.  info would be none.
-        if not info:
-            return 'unknown'
-        if info['state'] == koji.TASK_STATES['OPEN']:
-            if info['host_id']:
-                host = self.session.getHost(info['host_id'])
-                return 'open (%s)' % host['name']
-            else:
-                return 'open'
-        elif info['state'] == koji.TASK_STATES['FAILED']:
-            return 'FAILED: %s' % self.get_failure()
-        else:
-            return koji.TASK_STATES[info['state']].lower()
+from pipeline import ImportJob, Stage, Pipeline
+import rpmfile
+from hashcache import HashCache, hash_files
+from catalog import SrpmCatalog
+from journal import Journal
+from fastimport import FastImport
+from fileops import place_file
+from blobstore import BlobStore
+from provides import ProvidesIndex, build_requires
+from scheduler import BuildGraph, BuildScheduler
+import metrics
 
 class PySkein:
     """
@@ -145,6 +43,9 @@ class PySkein:
 
         self.username = None
         self.cfgs = {}
+        self._lock = threading.Lock()
+        # held while an ssh master logs in, which can take a while
+        self._ssh_lock = threading.Lock()
 
         for path in ['/etc/skein', '~/.skein']:
             expanded_path = "%s/%s" % (os.path.expanduser(path), 'skein.cfg')
@@ -206,6 +107,8 @@ class PySkein:
         :param str kojiconfig: Use an alternate koji config file
         """
 
+        import koji
+
         # Code from /usr/bin/koji. Should be in a library!
         defaults = {
                     'server' : 'http://localhost/kojihub',
@@ -262,177 +165,280 @@ class PySkein:
                 raise SkeinError('Could not auth with koji as %s' % user)
         return self.kojisession
 
-    # grab the details from the rpm and add them to the object
-    def _set_srpm_details(self, srpm):
+    # grab the details from the rpm and hand them back to the caller
+    def _get_srpm_details(self, srpm):
         """Gather details from the SRPM
 
         :param str srpm: path to the source RPM (SRPM)
+        :returns: dict of name, version, release, sources, patches, summary, url and buildrequires
         """
 
-        self.logger.info("== Querying srpm ==")
-        print "Querying srpm"
-        ts = rpm.ts()
-        ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
-    
-        fdno = open(u"%s" % srpm, 'r')
+        self.logger.info("== Querying srpm '%s' ==" % srpm)
+        print "Querying srpm %s" % srpm
+
+        rpminfo = self._catalog().lookup(srpm)
+        self.logger.info("  %s-%s-%s: %d source(s), %d patch(es)" % (rpminfo['name'], rpminfo['version'], rpminfo['release'], len(rpminfo['sources']), len(rpminfo['patches'])))
+
+        return rpminfo
+
+    def _extract_srpm(self, srpm, rpminfo, sources_dest, git_dest):
+        """Extract files from a source rpm (SRPM), streaming the payload
+        straight into place.  Archives go to sources_dest, everything
+        else (spec, patches, other sources) to git_dest.
+
+        :param str srpm: path to srpm
+        :param dict rpminfo: srpm details from _get_srpm_details
+        :param str source_dest: path to specific source location, where to put the source file(s)
+        :param str git_dest: path to git repo, patch file, spec file and other non-archive sources
+        """
+
+        self.logger.info("== Extracting sources ==")
+        print "Extracting sources for %s" % rpminfo['name']
+
+        source_exts = self.cfgs['skein']['source_exts'].split(',')
+
+        def dest_for(name):
+            if name in rpminfo['sources'] and name.rsplit('.')[-1] in source_exts:
+                return sources_dest
+            return git_dest
+
         try:
-            hdr = ts.hdrFromFdno(fdno)
-        except rpm.error, e:
-            if str(e) == "public key not available":
-                print str(e)
-        fdno.close()
-        
-        self.rpminfo = {}
-        self.logger.info("  Setting srpm name ==")
-        self.rpminfo['name'] = hdr[rpm.RPMTAG_NAME]
-        self.logger.info("  Setting srpm version ==")
-        self.rpminfo['version'] = hdr[rpm.RPMTAG_VERSION]
-        self.logger.info("  Setting srpm release ==")
-        self.rpminfo['release'] = hdr[rpm.RPMTAG_RELEASE]
-        self.logger.info("  Setting srpm sources ==")
-        self.rpminfo['sources'] = hdr[rpm.RPMTAG_SOURCE]
-        self.logger.info("  Setting srpm patches ==")
-        patches = []
-        for patch in hdr[rpm.RPMTAG_PATCH]:
-            patches.append(patch.replace('%{name}', self.rpminfo['name']))
-        self.rpminfo['patches'] = patches
-#        self.patches = hdr[rpm.RPMTAG_PATCH].replace('%{name}', self.name)
-        self.logger.info("  Setting srpm summary ==")
-        self.rpminfo['summary'] = hdr[rpm.RPMTAG_SUMMARY]
-        self.logger.info("  Setting srpm url ==")
-        self.rpminfo['url'] = hdr[rpm.RPMTAG_URL]
-        self.logger.info("  Setting srpm requires ==")
-        # note to self, the [:-2] strips off the rpmlib(FileDigests)' and 
-        #'rpmlib(CompressedFileNames)' which are provided by the 'rpm' rpm
-        self.rpminfo['buildrequires'] = hdr[rpm.RPMTAG_REQUIRES]
+            written = rpmfile.extract_payload(srpm, rpminfo, dest_for, self.logger)
+            metrics.count(bytes=written)
+            self.logger.info("  %d bytes extracted from %s" % (written, srpm))
+        except UnsupportedPayload as e:
+            self.logger.info("  %s, falling back to rpm -i" % e)
+            self._install_srpm(srpm, rpminfo)
+            self._copy_installed_srpm(rpminfo, sources_dest, git_dest)
+
+    def _catalog(self):
+        """Open the srpm header catalog named by catalog in skein.cfg, once
+
+        """
+
+        with self._lock:
+            if not getattr(self, 'catalog', None):
+                self.catalog = SrpmCatalog(self.cfgs['skein'].get('catalog',
+                        os.path.join(self.cfgs['skein']['install_root'], 'catalog.db')))
+        return self.catalog
+
+    def _rpm_catalog(self):
+        """Open the binary rpm catalog, kept beside the srpm one, once
+
+        """
+
+        with self._lock:
+            if not getattr(self, 'rpm_catalog', None):
+                self.rpm_catalog = SrpmCatalog(self._catalog().path, table='rpms', reader=rpmfile.read_provides)
+        return self.rpm_catalog
+
+    def _scan_srpms(self, srpms, workers, catalog=None):
+        """Refresh the catalog entries for srpms, reading changed headers in parallel
+
+        :param list srpms: paths to source rpms
+        :param int workers: number of header reading processes
+        :param catalog (optional): catalog to refresh, instead of the srpm one
+        :returns: list of the paths whose headers could be read
+        """
+
+        if catalog is None:
+            catalog = self._catalog()
+        self.logger.info("== Scanning %d %s header(s) ==" % (len(srpms), catalog.table[:-1]))
+        read, errors = catalog.scan(srpms, workers)
+        self.logger.info("  %d header(s) read, %d from the catalog" % (read, len(srpms) - read - len(errors)))
+        for path, error in errors.items():
+            self.logger.error("  unable to read header from '%s': %s" % (path, error))
+            print "Unable to read header from '%s': %s" % (path, error)
+        return [path for path in srpms if not errors.has_key(path)]
 
     # install the srpm in a temporary directory
-    def _install_srpm(self, srpm):
+    def _install_srpm(self, srpm, rpminfo):
         """Prepare SRPM to be extracted by installing in a temporary location
 
         :param str srpm: path to srpm
+        :param dict rpminfo: srpm details from _get_srpm_details
         """
 
         # rpm.ts is an alias for rpm.TransactionSet
         self.logger.info("== Installing srpm ==")
-        print "Installing srpm"
+        print "Installing srpm %s" % srpm
     
-        self._makedir(u"%s/%s" % (self.cfgs['skein']['install_root'], self.rpminfo['name']))
+        self._makedir(u"%s/%s" % (self.cfgs['skein']['install_root'], rpminfo['name']))
     
-        self.logger.info("  installing %s into %s/%s" % (srpm, self.cfgs['skein']['install_root'], self.rpminfo['name']))
-        args = ["/bin/rpm", "-i", "--root=%s/%s" % (self.cfgs['skein']['install_root'], self.rpminfo['name']), srpm]
+        self.logger.info("  installing %s into %s/%s" % (srpm, self.cfgs['skein']['install_root'], rpminfo['name']))
+        args = ["/bin/rpm", "-i", "--root=%s/%s" % (self.cfgs['skein']['install_root'], rpminfo['name']), srpm]
+        metrics.count(subprocesses=1)
         p = subprocess.call(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE )
 
-    def _extract_srpm(self, sources_dest, git_dest):
-        """Extract files from a source rpm (SRPM)
+    def _copy_installed_srpm(self, rpminfo, sources_dest, git_dest):
+        """Copy files from a source rpm (SRPM) installed by _install_srpm
 
+        :param dict rpminfo: srpm details from _get_srpm_details
         :param str source_dest: path to specific source location, where to put the source file(s)
         :param str git_dest: path to git repo, patch file, spec file and other non-archive sources 
         """
 
         self.logger.info("== Copying sources ==")
-        print "Copying sources"
+        print "Copying sources for %s" % rpminfo['name']
 
-        sources_path = "%s/%s%s/rpmbuild/SOURCES" % (self.cfgs['skein']['install_root'], self.rpminfo['name'], self.cfgs['skein']['home'])
-        spec_path = "%s/%s%s/rpmbuild/SPECS/*.spec" % (self.cfgs['skein']['install_root'], self.rpminfo['name'], self.cfgs['skein']['home'])
+        sources_path = "%s/%s%s/rpmbuild/SOURCES" % (self.cfgs['skein']['install_root'], rpminfo['name'], self.cfgs['skein']['home'])
+        spec_path = "%s/%s%s/rpmbuild/SPECS/*.spec" % (self.cfgs['skein']['install_root'], rpminfo['name'], self.cfgs['skein']['home'])
 
         source_exts = self.cfgs['skein']['source_exts'].split(',')
 
+        # the installed tree is scratch space, so files are moved out of it
+        # rather than copied wherever the filesystem allows
+        placed = []
+        def _place(src, dest):
+            method, avoided = place_file(src, dest, move=True)
+            self.logger.info("  placed '%s' in '%s' (%s)" % (os.path.basename(src), dest, method))
+            placed.append(avoided)
+
         # copy the spec file
 
         files = glob.glob(spec_path)
 
         for f in files:
-            self.logger.info("  copying '%s' to '%s'" % (os.path.basename(f), git_dest))
-            shutil.copy2(f, git_dest)
+            _place(f, git_dest)
 
         # copy the source files
-        for source in self.rpminfo['sources']:
+        for source in rpminfo['sources']:
             src = "%s/%s" % (sources_path, source)
 
             if src.rsplit('.')[-1] in source_exts:
-                self.logger.info("  copying '%s' to '%s'" % (source, sources_dest))
-                shutil.copy2("%s/%s" % (sources_path, source), sources_dest)
+                _place(src, sources_dest)
             else:
-                self.logger.info("  copying '%s' to '%s'" % (source, git_dest))
-                shutil.copy2("%s/%s" % (sources_path, source), git_dest)
+                _place(src, git_dest)
 
         # copy the patch files
-        for source in self.rpminfo['patches']:
-            self.logger.info("  copying '%s' to '%s'" % (source, git_dest))
-            shutil.copy2("%s/%s" % (sources_path, source), git_dest)
-    
+        for source in rpminfo['patches']:
+            _place("%s/%s" % (sources_path, source), git_dest)
+
+        self.logger.info("  %d bytes of copying avoided" % sum(placed))
+
+    def _hash_cache(self):
+        """Open the persistent hash cache named by hash_cache in skein.cfg, once
+
+        """
+
+        with self._lock:
+            if not getattr(self, 'hashcache', None):
+                self.hashcache = HashCache(self.cfgs['skein'].get('hash_cache',
+                        os.path.join(self.cfgs['skein']['install_root'], 'hashcache.db')))
+        return self.hashcache
+
+    def _store(self):
+        """Open the content-addressed source store named by store in skein.cfg, once
+
+        """
+
+        with self._lock:
+            if not getattr(self, 'blobstore', None):
+                self.blobstore = BlobStore(self.cfgs['skein'].get('store',
+                        os.path.join(self.cfgs['skein']['proj_dir'], '.store')))
+        return self.blobstore
+
     # this method assumes the sources are new and overwrites the 'sources' file in the git repository
-    def _generate_sha256(self, sources_dest, git_dest):
+    def _generate_sha256(self, rpminfo, sources_dest, git_dest):
         """Generate a sha256sum for each legitimate source file
 
+        :param dict rpminfo: srpm details from _get_srpm_details
         :param str source_dest: path to specific source location
         :param str git_dest: path to git repo, sources file is placed there with sums and filenames
         """
 
         self.logger.info("== Generating sha256sum for sources ==")
-        print "Generating sha256sum for sources"
+        print "Generating sha256sum for %s sources" % rpminfo['name']
 
         source_exts = self.cfgs['skein']['source_exts'].split(',')
-        sfile = open(u"%s/sources" % git_dest, 'w+')
+        archives = [src for src in rpminfo['sources'] if src.rsplit('.')[-1] in source_exts]
+        sums = hash_files(["%s/%s" % (sources_dest, src) for src in archives], self._hash_cache(),
+                int(self.cfgs['skein'].get('hash_workers', 4)))
+        metrics.count(bytes=sum([os.path.getsize(path) for path in sums]))
 
-        for src in self.rpminfo['sources']:
+        sfile = open(u"%s/sources" % git_dest, 'w+')
 
-            if src.rsplit('.')[-1] in source_exts:
-                sha256sum = hashlib.sha256(open("%s/%s" % (sources_dest, src), 'rb').read()).hexdigest()
-                sfile.write("%s *%s\n" % (sha256sum, src))
+        for src in archives:
+            sfile.write("%s *%s\n" % (sums["%s/%s" % (sources_dest, src)], src))
 
         sfile.close()
 
         self.logger.info("  sha256sums generated and added to %s/sources" % git_dest)
 
+        # archives shared with other packages or versions end up as links
+        # to a single copy in the store
+        store = self._store()
+        deduped = 0
+        for path, sha256 in sums.items():
+            deduped += store.add(path, sha256)
+        if deduped:
+            self.logger.info("  %d bytes of sources already in the store" % deduped)
+
     def _init_git_repo(self, repo_dir, name):
         """Create a git repository pointing to appropriate github repo
 
         :param str repo_dir: full path to existing or potential repo
         :param str name: name of package/repo
+        :returns: git.Repo for repo_dir
         """
+        # GitPython
+        import git
+        from git import InvalidGitRepositoryError, NoSuchPathError, GitCommandError
+
         self.logger.info("== Creating local git repository at '%s' ==" % repo_dir)
         print "Creating local git repository at '%s'" % repo_dir
 
-        self._init_git_remote()
+        if not getattr(self, 'gitremote', None):
+            self._init_git_remote()
         scm_url = self.gitremote.get_scm_url(name)
 
         try:
-            self.repo = git.Repo(repo_dir)
+            repo = git.Repo(repo_dir)
         except NoSuchPathError as e:
             raise SkeinError("Path '%s' does not exist, please run 'skein extract' first" % e)
         except InvalidGitRepositoryError, e:
             gitrepo = git.Git(repo_dir)
             cmd = ['git', 'init']
             result = git.Git.execute(gitrepo, cmd)
-            self.repo = git.Repo(repo_dir)
+            repo = git.Repo(repo_dir)
         try:
             self.logger.info("  Setting origin to '%s'" % scm_url)
-            self.repo.create_remote('origin', scm_url)
+            repo.create_remote('origin', scm_url)
         except (AssertionError, GitCommandError), e:
             print "repo path '%s' already exists, skipping" % repo_dir
             self.logger.info("repo path '%s' already exists, skipping" % repo_dir)
             self.logger.debug("--- Exception thrown %s" % e)
 
+        return repo
+
     # attribution to fedpkg, written by 'Jesse Keating' <jkeating@redhat.com> for this snippet
-    def _update_gitignore(self, path):
+    def _update_gitignore(self, rpminfo, path):
  
         self.logger.info("  Updating .gitignore with sources")
         gitignore_file = open("%s/%s" % (path, '.gitignore'), 'w')
+        gitignore_file.write(self._gitignore_content(rpminfo))
+        gitignore_file.close()
+
+    def _gitignore_content(self, rpminfo):
         source_exts = self.cfgs['skein']['source_exts'].split(',')
-        for src in self.rpminfo['sources']:
+        content = ''
+        for src in rpminfo['sources']:
 
             if src.rsplit('.')[-1] in source_exts:
                 self.logger.info("  writing '%s' to .gitignore" % src)
-                gitignore_file.write("%s\n" % src)
+                content += "%s\n" % src
 
-        gitignore_file.close()
+        return content
 
     # search for a makefile.tpl in the makefile_path and use
     # it as a template to put in each package's repository
-    def _do_makefile(self, dest_path):
+    def _do_makefile(self, rpminfo, dest_path):
         self.logger.info("  Updating Makefile")
+        dst_makefile = open("%s/Makefile" % dest_path, 'w')
+        dst_makefile.write(self._makefile_content(rpminfo))
+        dst_makefile.close()
+
+    def _makefile_content(self, rpminfo):
         found = False
         for path in self.cfgs['skein']['path'].split(':'):
             expanded_path = "%s/%s" % (os.path.expanduser(path), self.cfgs['makefile']['name'])
@@ -449,115 +455,360 @@ class PySkein:
 #        print "makefile template found at %s" % makefile_template
 
         src_makefile = open(makefile_template)
-        dst_makefile = open("%s/Makefile" % dest_path, 'w')
+        content = src_makefile.read() % {'name': rpminfo['name']}
+        src_makefile.close()
 
-        dst_makefile.write( src_makefile.read() % {'name': self.rpminfo['name']})
-        dst_makefile.close()
+        return content
+
+    def _ssh_command(self, master='auto'):
+        """ssh command line shared by every connection to the lookaside host.
+        Connections are multiplexed over a persistent master, so only the
+        first one pays for the handshake.
+
+        :param str master: ControlMaster setting; ssh keeps the first value
+                           given, so it can't be overridden later on the line
+        """
+
+        return [self.cfgs['lookaside'].get('ssh', '/usr/bin/ssh'),
+                '-o', 'ControlMaster=%s' % master,
+                '-o', 'ControlPath=%s' % self.cfgs['lookaside'].get('control_path',
+                        os.path.join(self.cfgs['lookaside']['install_root'], 'ssh-%r@%h:%p')),
+                '-o', 'ControlPersist=%s' % self.cfgs['lookaside'].get('control_persist', '600')]
 
-    def _upload_source(self, name):
+    def _ssh_master(self, user, host):
+        """Start the persistent ssh master for user@host, if it isn't running
+
+        :param str user: remote user
+        :param str host: remote host
+        """
+
+        with self._ssh_lock:
+            if not hasattr(self, '_ssh_masters'):
+                self._ssh_masters = set()
+            if (user, host) in self._ssh_masters:
+                return
+            self._ssh_masters.add((user, host))
+
+            # -N never opens a session, so the forced command isn't run
+            args = self._ssh_command('yes') + ['-N', '-f', "%s@%s" % (user, host)]
+            check = self._ssh_command() + ['-O', 'check', "%s@%s" % (user, host)]
+            devnull = open(os.devnull, 'w')
+            try:
+                metrics.count(subprocesses=1)
+                if subprocess.call(check, stdout=devnull, stderr=devnull) != 0:
+                    self.logger.debug("  starting ssh master for %s@%s" % (user, host))
+                    metrics.count(subprocesses=1)
+                    subprocess.call(args, stdout=devnull, stderr=devnull)
+            finally:
+                devnull.close()
+
+    def _remote_manifest(self, name):
+        """Fetch the sha256 and size of each file already on the lookaside for name
+
+        :param str name: package name
+        :returns: dict of file name to (sha256, size), or None if the
+                  lookaside host can't produce a manifest
+        """
+
+        lookaside_host = self.cfgs['lookaside']['host']
+        lookaside_user = self.cfgs['lookaside']['user']
+
+        self._ssh_master(lookaside_user, lookaside_host)
+        args = self._ssh_command() + ["%s@%s" % (lookaside_user, lookaside_host), "manifest %s" % name]
+        metrics.count(subprocesses=1, rpcs=1)
+        p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        if p.returncode != 0:
+            self.logger.debug("  manifest for '%s' unavailable: %s" % (name, (out + err).strip()))
+            return None
+
+        manifest = {}
+        for line in out.splitlines():
+            try:
+                sha256, size, src = line.split(' ', 2)
+                manifest[src] = (sha256, int(size))
+            except ValueError:
+                self.logger.debug("  unexpected manifest line for '%s': %s" % (name, line))
+                return None
+        return manifest
+
+    def _local_sums(self, name):
+        """Read the sha256 sums from the 'sources' file in a package's git dir
+
+        :param str name: package name
+        :returns: dict of file name to sha256
+        """
+
+        sums = {}
+        sources = "%s/%s/%s/sources" % (self.cfgs['skein']['proj_dir'], name, self.cfgs['skein']['git_dir'])
+        if os.path.exists(sources):
+            for line in open(sources):
+                if ' *' in line:
+                    sha256, src = line.rstrip('\n').split(' *', 1)
+                    sums[src] = sha256
+        return sums
+
+    def _upload_source(self, name, full=False):
+        """Upload a package's source archives to the lookaside cache. Unless
+        full is set, files the lookaside already has with the same sha256 and
+        size are skipped.
+
+        :param str name: package name
+        :param bool full: upload every archive, without asking for a manifest
+        """
 
         self.logger.info("== Uploading Source(s) ==")
         source_dir = "%s/%s/%s" % (self.cfgs['skein']['proj_dir'], name, self.cfgs['skein']['lookaside_dir'])
         lookaside_host = self.cfgs['lookaside']['host']
+        lookaside_user = self.cfgs['lookaside']['user']
         source_exts = self.cfgs['skein']['source_exts'].split(',')
 
-        os.chdir(source_dir)
-        uploaded = False
+        store = self._store()
+        sums = self._local_sums(name)
+        archives = [src for src in sorted(os.listdir(os.path.expanduser(source_dir))) if src.rsplit('.')[-1] in source_exts]
+
+        manifest = None
+        known = []
+        if not full:
+            # only ask the lookaside host about what we haven't uploaded before
+            known = [src for src in archives if sums.has_key(src) and store.uploaded(name, src, sums[src])]
+            if len(known) < len(archives):
+                manifest = self._remote_manifest(name)
+
+        srcs = []
+        skipped = 0
+        for src in archives:
+            if src in known:
+                self.logger.info("  '%s/%s' uploaded before, skipping" % (source_dir, src))
+                skipped += 1
+                continue
+            if manifest is not None and manifest.has_key(src):
+                sha256, size = manifest[src]
+                if size == os.path.getsize("%s/%s" % (source_dir, src)) and sums.get(src) == sha256:
+                    self.logger.info("  '%s/%s' already on '%s', skipping" % (source_dir, src, lookaside_host))
+                    store.set_uploaded(name, {src: sha256})
+                    skipped += 1
+                    continue
+            self.logger.info("  uploading '%s/%s' to '%s'" % (source_dir, src, lookaside_host))
+            print "uploading '%s' to '%s'" % (src, lookaside_host)
+            srcs.append(src)
+
+        if not srcs:
+            if skipped:
+                self.logger.info("  all %d source(s) for '%s' already uploaded" % (skipped, name))
+                print "all sources for '%s' already uploaded" % name
+            else:
+                self.logger.info("  nothing to upload for '%s'" % name)
+                print "nothing to upload for '%s'" % name
+            return
 
-        for src in os.listdir(os.path.expanduser(source_dir)):
-            if src.rsplit('.')[-1] in source_exts:
-                self.logger.info("  uploading '%s/%s' to '%s'" % (source_dir, src, lookaside_host))
-                print "uploading '%s' to '%s'" % (src, lookaside_host)
+        # one transfer for all of the package's sources
+        self._ssh_master(lookaside_user, lookaside_host)
+        # rsync splits -e on whitespace, honouring quotes
+        args = ["/usr/bin/rsync", "--progress", "-loDtRz", "-e", " ".join([pipes.quote(arg) for arg in self._ssh_command()])]
+        # an archive already uploaded for another package is hardlinked on
+        # the lookaside host instead of sent again (rsync allows 20 of these)
+        others = []
+        for src in srcs:
+            if sums.has_key(src):
+                for other in store.uploaded_elsewhere(name, src, sums[src]):
+                    if other not in others:
+                        others.append(other)
+        for other in others[:20]:
+            args.append("--link-dest=../%s/" % other)
+        args.extend(srcs)
+        args.append("%s@%s:%s/%s/" % (lookaside_user, lookaside_host, self.cfgs['lookaside']['remote_dir'], name))
+
+        metrics.count(bytes=sum([os.path.getsize("%s/%s" % (source_dir, src)) for src in srcs]), subprocesses=1)
+        devnull = open(os.devnull, 'w')
+        try:
+            rc = subprocess.call(args, cwd="%s" % (source_dir), stdout=devnull)
+        finally:
+            devnull.close()
+
+        if rc != 0:
+            raise SkeinError("Uploading sources for '%s' to '%s' failed, rsync returned %d" % (name, lookaside_host, rc))
+        self.logger.info("  %d source(s) uploaded for '%s'" % (len(srcs), name))
+        store.set_uploaded(name, dict((src, sums[src]) for src in srcs if sums.has_key(src)))
+
+    def _commit_message(self):
+        """Prompt for a commit message with the EDITOR value
+
+        """
+
+        editor = os.environ.get('EDITOR') if os.environ.get('EDITOR') else self.cfgs['skein']['editor']
+
+        tmp_file = tempfile.NamedTemporaryFile(suffix=".tmp")
+
+        initial_message = self.cfgs['git']['commit_message']
+
+        tmp_file.write(initial_message)
+        tmp_file.flush()
 
-                args = ["/usr/bin/rsync", "--progress", "-loDtRz", "-e", "ssh", "%s" % src, "%s@%s:%s/%s/" % ( self.cfgs['lookaside']['user'], lookaside_host, self.cfgs['lookaside']['remote_dir'], name)]
-                p = subprocess.call(args, cwd="%s" % (source_dir), stdout = subprocess.PIPE)
-                uploaded = True
+        cmd = [editor, tmp_file.name]
 
-        if not uploaded:
-            self.logger.info("  nothing to upload for '%s'" % name)
-            print "nothing to upload for '%s'" % name
+        try:
+            p = subprocess.check_call(cmd)
+            f = open(tmp_file.name, 'r')
+            reason = f.read()
+
+            if not reason:
+                raise SkeinError("Description required.")
+            elif reason == initial_message:
+                raise SkeinError("Description has not changed.")
+
+        except subprocess.CalledProcessError:
+            raise SkeinError("Action cancelled by user.")
+
+        return reason
+
+    def _lazy_commit_message(self):
+        """A callable that prompts for a commit message the first time one is
+        needed, from whichever worker needs it, and returns the same message
+        (or raises the same error) every time after
+
+        """
+
+        lock = threading.Lock()
+        asked = []
+        def message():
+            with lock:
+                if not asked:
+                    try:
+                        asked.append((self._commit_message(), None))
+                    except SkeinError as e:
+                        asked.append((None, e))
+            reason, e = asked[0]
+            if e:
+                raise e
+            return reason
+        return message
+
+    def _git(self, repo_dir, args, stdin=None, check=True, env=None):
+        """Run a git command in repo_dir
+
+        :param str repo_dir: path to the repository's working tree
+        :param list args: git subcommand and its arguments
+        :param str stdin: data fed to the command
+        :param bool check: raise SkeinError if the command fails
+        :param dict env: extra environment for the command
+        :returns: the command's stdout, or None if it failed and check is False
+        """
 
-    def _commit(self, reason=None):
+        if env:
+            env = dict(os.environ, **env)
+        metrics.count(subprocesses=1)
+        p = subprocess.Popen(['git'] + args, cwd=repo_dir, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        out, err = p.communicate(stdin)
+        if p.returncode != 0:
+            if check:
+                raise SkeinError("git %s failed in '%s': %s" % (args[0], repo_dir, err.strip()))
+            return None
+        return out
+
+    def _git_status(self, repo_dir):
+        """Classify every change in the working tree with a single git status
+
+        :param str repo_dir: path to the repository's working tree
+        :returns: list of (status, path) tuples, status being the porcelain XY code
+        """
+
+        out = self._git(repo_dir, ['status', '--porcelain', '-z', '--untracked-files=all'])
+        changes = []
+        entries = out.split('\0')
+        while entries:
+            entry = entries.pop(0)
+            if not entry:
+                continue
+            status, path = entry[:2], entry[3:]
+            if status[0] in 'RC':
+                # renames and copies are followed by their original path
+                changes.append(('D ', entries.pop(0)))
+            changes.append((status, path))
+        return changes
+
+    def _commit(self, repo_dir, reason=None):
         """Commit is only called in two cases, if there are uncommitted changes
         or if there are newly added (aka untracked) files which need to be added to
         the local repository prior to being pushed up to the remote repository.
 
-        :param str message: Optional message, will be prompted if not supplied inline.
+        The commit is built with plumbing: one status, one update-index for
+        every changed path, write-tree, commit-tree and update-ref, however
+        many files changed.
 
+        :param str repo_dir: path to the repository's working tree
+        :param reason: Optional message, or a callable returning one, only
+                       used if there is something to commit. Will be prompted
+                       if not supplied inline.
+        :returns: True if a commit was made
         """
 
         self.logger.info("||== Committing git repo ==||")
 
+        changes = self._git_status(repo_dir)
+        if not changes:
+            self.logger.info("  nothing to commit in '%s'" % repo_dir)
+            return False
+
+        self.logger.debug("   repo '%s' has been a DIRTY girl!" % repo_dir)
+
+        if callable(reason):
+            reason = reason()
         if not reason:
-            editor = os.environ.get('EDITOR') if os.environ.get('EDITOR') else self.cfgs['skein']['editor']
+            reason = self._commit_message()
 
-            tmp_file = tempfile.NamedTemporaryFile(suffix=".tmp")
+        self.logger.info("  adding %d updated, deleted and untracked file(s) to the index" % len(changes))
+        paths = sorted(set([path for status, path in changes]))
+        self._git(repo_dir, ['update-index', '--add', '--remove', '-z', '--stdin'], '\0'.join(paths) + '\0')
 
-            initial_message = self.cfgs['git']['commit_message']
+        self.logger.info("  committing index")
+        tree = self._git(repo_dir, ['write-tree']).strip()
+        parent = self._git(repo_dir, ['rev-parse', '-q', '--verify', 'HEAD'], check=False)
+        args = ['commit-tree', tree]
+        if parent:
+            args.extend(['-p', parent.strip()])
+        commit = self._git(repo_dir, args + ['-F', '-'], reason).strip()
 
-            tmp_file.write(initial_message)
-            tmp_file.flush()
+        args = ['update-ref', '-m', 'commit: %s' % reason.splitlines()[0], 'HEAD', commit]
+        if parent:
+            args.append(parent.strip())
+        self._git(repo_dir, args)
 
-            cmd = [editor, tmp_file.name]
+        return True
 
-            try:
-                p = subprocess.check_call(cmd)
-                f = open(tmp_file.name, 'r')
-                reason = f.read()
-
-                if not reason:
-                    raise SkeinError("Description required.")
-                elif reason == initial_message:
-                    raise SkeinError("Description has not changed.")
-
-            except subprocess.CalledProcessError:
-                raise SkeinError("Action cancelled by user.")
-
-        index = self.repo.index
-
-        self.logger.info("  adding updated files to the index")
-        index_changed = False
-        if self.repo.is_dirty():
-           #print "index: %s" % index
-#            for diff in index.diff(None):
-#                print diff.a_blob.path
-
-            index.add([diff.a_blob.path.rstrip('\n') for diff in index.diff(None)])
-            index_changed = True
-
-        self.logger.info("  adding untracked files to the index") 
-        # add untracked files
-        path = os.path.split(self.cfgs['skein']['proj_dir'])[0]
-        #print "path: %s" % path
-        if self.repo.untracked_files:
-#            print "untracked files: %s" % self.repo.untracked_files
-            index.add(self.repo.untracked_files)
-            index_changed = True
-
-        if index_changed:
-            self.logger.info("  committing index")
-            # commit files added to the index
-            index.commit(reason)
-
-    def _push_to_remote(self, name, message=None):
+    def _commit_pkg(self, name, message=None):
+        """Commit any/all changes in a package's local repository
+
+        :param str name: repository name (same as package)
+        :param message: Optional message, or a callable returning one. Will be prompted if not supplied inline.
+        :returns: git.Repo for the package
+        """
+
+        proj_dir = "%s/%s" % (self.cfgs['skein']['proj_dir'], name)
+        repo = self._init_git_repo("%s/%s" % (proj_dir, self.cfgs['skein']['git_dir']), name)
+
+        self._commit(repo.working_dir, message)
+
+        return repo
+
+    def _push_to_remote(self, name, message=None, repo=None):
         """Push any/all changes to remote repository
 
         :param str name: repository name (same as package)
+        :param message: Optional message, or a callable returning one, used if there are changes to commit
+        :param git.Repo repo: already committed repository, skips the commit
         """
 
         self.logger.info("== Pushing git repo ==")
 
-        proj_dir = "%s/%s" % (self.cfgs['skein']['proj_dir'], name)
-        self._init_git_repo("%s/%s" % (proj_dir, self.cfgs['skein']['git_dir']), name)
-
-        if self.repo.is_dirty() or self.repo.untracked_files:
-            self.logger.debug("   repo '%s' has been a DIRTY girl!" % self.repo)
-            self._commit(message)
+        if not repo:
+            repo = self._commit_pkg(name, message)
 
         try:
-            self.logger.info("   Pushing '%s' to remote '%s'" % (self.repo, self.repo.remote()))
-            print "Pushing local git repo '%s' to remote '%s'" % (self.repo.working_dir, self.repo.remotes['origin'].url)
-            self.repo.remotes['origin'].push('refs/heads/master:refs/heads/master')
+            self.logger.info("   Pushing '%s' to remote '%s'" % (repo, repo.remote()))
+            print "Pushing local git repo '%s' to remote '%s'" % (repo.working_dir, repo.remotes['origin'].url)
+            repo.remotes['origin'].push('refs/heads/master:refs/heads/master')
         except IndexError, e:
             print "--- Push failed with error: %s ---" % e
             self.logger.debug("--- Push failed with error: %s" % e)
@@ -571,59 +822,143 @@ class PySkein:
                 self.logger.debug("--- Push failed with error: %s" % e)
                 raise 
 
+    def _list_pkgs(self):
+        """Names of every package under proj_dir with a local git repository"""
+
+        proj_dir = self.cfgs['skein']['proj_dir']
+        if not os.path.isdir(proj_dir):
+            return []
+        git_dir = self.cfgs['skein']['git_dir']
+        return sorted([name for name in os.listdir(proj_dir)
+                if os.path.isdir("%s/%s/%s/.git" % (proj_dir, name, git_dir))])
+
+    def _push_pkg(self, name, scm_url, message=None):
+        """Commit and push one package's repository with plain git, skipping
+        the push when master already matches what origin was last told
+
+        :param str name: repository name (same as package)
+        :param str scm_url: origin to set if the repository has none
+        :param message: commit message, or a callable returning one, used
+                        only if there are changes to commit
+        :returns: 'pushed' or 'up to date'
+        """
+
+        repo_dir = "%s/%s/%s" % (self.cfgs['skein']['proj_dir'], name, self.cfgs['skein']['git_dir'])
+        if not os.path.isdir("%s/.git" % repo_dir):
+            raise SkeinError("'%s' has no git repository, please run 'skein extract' first" % repo_dir)
+
+        if self._git_status(repo_dir):
+            if callable(message):
+                message = message()
+            self._commit(repo_dir, message)
+
+        if not self._git(repo_dir, ['config', 'remote.origin.url'], check=False):
+            self.logger.info("  Setting origin of '%s' to '%s'" % (name, scm_url))
+            self._git(repo_dir, ['remote', 'add', 'origin', scm_url])
+
+        local = self._git(repo_dir, ['rev-parse', '-q', '--verify', 'refs/heads/master'], check=False)
+        if not local:
+            raise SkeinError("'%s' has nothing committed to push" % repo_dir)
+        # push updates refs/remotes/origin/master, so this is what origin
+        # had when skein last pushed or fetched
+        remote = self._git(repo_dir, ['rev-parse', '-q', '--verify', 'refs/remotes/origin/master'], check=False)
+        if local == remote:
+            self.logger.info("  '%s' master already matches origin" % name)
+            return 'up to date'
+
+        self.logger.info("  Pushing '%s'" % name)
+        # ssh pushes to the same host share one persistent connection
+        env = None
+        if not os.environ.has_key('GIT_SSH_COMMAND'):
+            # git runs this through the shell
+            env = {'GIT_SSH_COMMAND': ' '.join([pipes.quote(arg) for arg in self._ssh_command()])}
+        self._git(repo_dir, ['push', '-q', 'origin', 'refs/heads/master:refs/heads/master'], env=env)
+        return 'pushed'
+
+    def report_metrics(self, path=None):
+        """Log and print the per stage summary of this run, if anything was
+        timed, and write the run's metrics to path
+
+        :param str path: JSON lines file to append to, or a Prometheus
+                         textfile if it ends in .prom
+        """
+
+        if not metrics.collector.spans:
+            return
+
+        report = metrics.collector.report()
+        for line in report.splitlines():
+            self.logger.info("  %s" % line)
+        print report
+
+        if path:
+            metrics.collector.write(path)
+            self.logger.info("  metrics written to '%s'" % path)
+
     def _get_srpm_list(self, path):
 
         if os.path.isdir(path):
-            return os.listdir(path)
+            return sorted([os.path.join(path, f) for f in os.listdir(path) if f.endswith('.src.rpm')])
         elif os.path.isfile(path):
             return [path]
         else:
             print "'%s' is not valid" % path
             sys.exit(1)
 
+    def _koji_multicall(self, session, calls, strict=True):
+        """Make several koji calls in as few round trips as possible, at most
+        multicall_batch calls per round trip
+
+        :param session: koji.ClientSession
+        :param list calls: (method, args, kwargs) tuples
+        :param bool strict: raise on the first fault, otherwise return the fault dict in its place
+        :returns: list of results, in the order of calls
+        """
+
+        batch = int(self.cfgs['koji'].get('multicall_batch', 100))
+        results = []
+
+        for i in range(0, len(calls), batch):
+            chunk = calls[i:i + batch]
+            metrics.count(rpcs=1)
+            session.multicall = True
+            for method, args, kwargs in chunk:
+                getattr(session, method)(*args, **kwargs)
+
+            for (method, args, kwargs), result in zip(chunk, session.multiCall()):
+                if isinstance(result, dict):
+                    if strict:
+                        raise SkeinError("koji %s%s failed: %s" % (method, args, result.get('faultString')))
+                    results.append(result)
+                else:
+                    results.append(result[0])
+        return results
+
     def _watch_koji_tasks(self, session, tasklist, quiet=False):
+        """Follow koji tasks and their children until they are all done
+
+        :param session: koji.ClientSession
+        :param list tasklist: top level task ids
+        :param bool quiet: only show state changes of the top level tasks
+        :returns: 0 if every task succeeded, 1 otherwise
+        """
+
         if not tasklist:
             return
         self.logger.info('Watching tasks (this may be safely interrupted)...')
         print 'Watching tasks (this may be safely interrupted)...'
         # Place holder for return value
         rv = 0
+
+        watcher = self._tree_watcher(session, quiet)
+        for task_id in tasklist:
+            watcher.add(int(task_id))
+
         try:
-            tasks = {}
-            for task_id in tasklist:
-                tasks[task_id] = TaskWatcher(task_id, session, quiet=quiet)
-            while True:
-                all_done = True
-                for task_id,task in tasks.items():
-                    changed = task.update()
-                    if not task.is_done():
-                        all_done = False
-                    else:
-                        if changed:
-                            # task is done and state just changed
-                            if not quiet:
-                                pass
-                                #_display_tasklist_status(tasks)
-                        if not task.is_success():
-                            rv = 1
-                    for child in session.getTaskChildren(task_id):
-                        child_id = child['id']
-                        if not child_id in tasks.keys():
-                            tasks[child_id] = TaskWatcher(child_id, session, task.level + 1, quiet=quiet)
-                            tasks[child_id].update()
-                            # If we found new children, go through the list again,
-                            # in case they have children also
-                            all_done = False
-                if all_done:
-                    if not quiet:
-                        print
-                        #_display_task_results(tasks)
-                    break
-
-                time.sleep(1)
+            rv = watcher.run()
         except (KeyboardInterrupt):
-            if tasks:
-                kbd_msg = """\nTasks still running. You can continue to watch with the 'koji watch-task' command.  Running Tasks: %s""" % '\n'.join(['%s: %s' % (t.str(), t.display_state(t.info)) for t in tasks.values() if not t.is_done()])
+            if not watcher.done():
+                kbd_msg = """\nTasks still running. You can continue to watch with the 'skein watch' command.  Running Tasks: %s""" % watcher.running()
                 self.logger.info(kbd_msg)
                 print kbd_msg
 
@@ -632,7 +967,27 @@ class PySkein:
             #rv = 1
         return rv
 
-    def _init_git_remote(self):
+    def _tree_watcher(self, session, quiet=False):
+        """A kojiwatch.TreeWatcher set up from the [koji] section of skein.cfg
+
+        :param session: koji.ClientSession
+        :param bool quiet: only show state changes of the top level tasks
+        """
+
+        from kojiwatch import TreeWatcher
+
+        # poll quickly while things are happening, back off while they aren't
+        return TreeWatcher(lambda calls: self._koji_multicall(session, calls), session,
+                max_calls=self.cfgs['koji'].get('multicall_batch', 100),
+                min_interval=self.cfgs['koji'].get('watch_interval', 1),
+                max_interval=self.cfgs['koji'].get('watch_max_interval', 30),
+                status_interval=self.cfgs['koji'].get('watch_status_interval', 10),
+                quiet=quiet)
+
+    def _new_git_remote(self):
+        """Instantiate the remote class named in the [git] section of skein.cfg
+
+        """
 
         remoteClassName = self.cfgs['git']['remote_class']
         remoteModuleName = self.cfgs['git']['remote_module']
@@ -642,44 +997,114 @@ class PySkein:
                                       globals(),
                                       locals(),
                                       [remoteClassName])
-            self.gitremote = GitRemote(remoteModule.__dict__[remoteClassName], self.cfgs, self.logger)
+            return GitRemote(remoteModule.__dict__[remoteClassName], self.cfgs, self.logger)
         except ImportError, e:
             self.logger.debug("Remote class %s in module %s not found: %s" % (remoteClassName, remoteModuleName, e))
             raise SkeinError("Remote class %s in module %s not found: %s" % (remoteClassName, remoteModuleName, e))
 
-    def _create_lookaside_dir(self, name):
-        self.logger.info("== Creating project dir on lookaside cache ==")
-        print "Creating project dir on lookaside cache"
+    def _init_git_remote(self):
+
+        self.gitremote = self._new_git_remote()
+
+    def _thread_git_remote(self):
+        """A git remote for the calling thread. Remote connections (httplib2
+        in github2, for one) are not safe to share between threads.
+
+        """
+
+        if not hasattr(self, '_local'):
+            with self._lock:
+                if not hasattr(self, '_local'):
+                    self._local = threading.local()
+        if not getattr(self._local, 'gitremote', None):
+            self._local.gitremote = self._new_git_remote()
+        return self._local.gitremote
 
-        lookaside_dir = "%s/%s" % (self.cfgs['lookaside']['remote_dir'], name)
+    def _map(self, func, items, workers):
+        """Run func over items on at most workers threads
+
+        :returns: list of (item, result, exception) tuples, in the order of items
+        """
+
+        def _run(item):
+            try:
+                return item, func(item), None
+            except Exception as e:
+                self.logger.debug("  %s failed: %s" % (item, e))
+                return item, None, e
+
+        if workers <= 1 or len(items) <= 1:
+            return [_run(item) for item in items]
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(items)))
+        try:
+            return pool.map_async(_run, items).get(365 * 86400)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _create_lookaside_dirs(self, names):
+        """Create the project dirs for several packages on the lookaside host, in one ssh call
+
+        :param list names: package names
+        """
+
+        self.logger.info("== Creating project dir(s) on lookaside cache ==")
+        print "Creating %d project dir(s) on lookaside cache" % len(names)
+
+        lookaside_dirs = ["%s/%s" % (self.cfgs['lookaside']['remote_dir'], name) for name in names]
         lookaside_host = self.cfgs['lookaside']['host']
         lookaside_user = self.cfgs['lookaside']['grant_user']
 
-        args = ["/usr/bin/ssh", "%s@%s" % (lookaside_user, lookaside_host), '/bin/mkdir %s' % lookaside_dir]
+        self._ssh_master(lookaside_user, lookaside_host)
+        args = self._ssh_command() + ["%s@%s" % (lookaside_user, lookaside_host), '/bin/mkdir -p %s' % ' '.join(lookaside_dirs)]
+        metrics.count(subprocesses=1, rpcs=1)
         p = subprocess.call(args, cwd=".", stdout = subprocess.PIPE)
+        if p != 0:
+            raise SkeinError("Unable to create lookaside dir(s) on '%s', ssh returned %d" % (lookaside_host, p))
 
-    def _enable_pkg(self, name, summary, url, gitowner=None, kojiowner=None, tag=None):
+    def _tag_pkgs(self, tag, pkgs):
+        """Add packages to a koji tag, checking and adding each in batched multicalls
 
-        if not tag:
-            tag = self.cfgs['koji']['latest_tag']
+        :param str tag: koji tag
+        :param list pkgs: (name, kojiowner) tuples
+        :returns: dict of package name to error for those that could not be added
+        """
 
-        self.logger.info("  Requesting remote repo for '%s'" % name)
-        print "Requesting remote repo for '%s'" % name
+        names = [name for name, kojiowner in pkgs]
+        tagged = self._koji_multicall(self.kojisession, [('checkTagPackage', (tag, name), {}) for name in names])
 
-        self.gitremote.create_remote_repo(name, summary, url)
-        self.gitremote.create_team("%s_%s" % (self.cfgs['skein']['team_prefix'], name), 'admin', gitowner, [name])
+        todo = []
+        for (name, kojiowner), exists in zip(pkgs, tagged):
+            if exists:
+                self.logger.info("== Package '%s' already added to tag '%s'" % (name, tag))
+                print "Package '%s' already added to tag '%s', skipping" % (name, tag)
+            else:
+                todo.append((name, kojiowner))
 
-        try:
-            if not self.kojisession.checkTagPackage(tag, name):
-                self.kojisession.packageListAdd(tag, name, owner=kojiowner)
+        errors = {}
+        results = self._koji_multicall(self.kojisession, [('packageListAdd', (tag, name), {'owner': kojiowner}) for name, kojiowner in todo], strict=False)
+        for (name, kojiowner), result in zip(todo, results):
+            if isinstance(result, dict):
+                errors[name] = SkeinError("Unable to tag package %s due to error: %s" % (name, result.get('faultString')))
+            else:
                 self.logger.info("== Added package '%s' to the tag '%s'" % (name, tag))
                 print "Added package '%s' to the tag '%s'" % (name, tag)
-            else:
-                self.logger.info("== Package '%s' already added to tag '%s'" % (name, tag))
-                print "Package '%s' already added to tag '%s', skipping" % (name, tag)
+        return errors
+
+    def _enable_pkg_remote(self, name, summary, url, gitowner=None):
+        """Create the remote repository and team for a package
+
+        """
+
+        remote = self._thread_git_remote()
+
+        self.logger.info("  Requesting remote repo for '%s'" % name)
+        print "Requesting remote repo for '%s'" % name
 
-        except (xmlrpclib.Fault,koji.GenericError) as e:
-            raise SkeinError("Unable to tag package %s due to error: %s" % (name, e))
+        remote.create_remote_repo(name, summary, url)
+        remote.create_team("%s_%s" % (self.cfgs['skein']['team_prefix'], name), 'admin', gitowner, [name])
 
     def repo_info(self, args):
         """Grab useful information from a repository
@@ -728,12 +1153,48 @@ class PySkein:
             name = args.name
             return self.gitremote.request_repo(name)
 
+        if args.path and os.path.isdir(args.path):
+            return self._request_remote_repos(args.path, args.force)
+
         if args.path:
             path = args.path
             force = args.force
             # need to get the name, summary and url values from the srpm
-            self._set_srpm_details(path)
-            return self.gitremote.request_repo(self.rpminfo['name'], self.rpminfo['summary'], self.rpminfo['url'], force)
+            rpminfo = self._get_srpm_details(path)
+            return self.gitremote.request_repo(rpminfo['name'], rpminfo['summary'], rpminfo['url'], force)
+
+    def _request_remote_repos(self, path, force=False):
+        """Request a remote repository for every srpm in a directory. Conflicts
+        are checked against the local issue index and reported, without
+        stopping the rest of the requests.
+
+        :param str path: directory of source rpms
+        :param bool force: don't confirm each request
+        """
+
+        srpms = self._get_srpm_list(path)
+        self._scan_srpms(srpms, int(self.cfgs['skein'].get('jobs', 1)))
+
+        requested = 0
+        failed = []
+        seen = set()
+        for srpm in srpms:
+            rpminfo = self._get_srpm_details(srpm)
+            if rpminfo['name'] in seen:
+                continue
+            seen.add(rpminfo['name'])
+
+            try:
+                self.gitremote.request_repo(rpminfo['name'], rpminfo['summary'], rpminfo['url'], force)
+                requested += 1
+            except SkeinError as e:
+                self.logger.info("  request for '%s' not filed: %s" % (rpminfo['name'], e))
+                print "Request for '%s' not filed: %s" % (rpminfo['name'], e)
+                failed.append(rpminfo['name'])
+
+        print "%d request(s) filed, %d not filed" % (requested, len(failed))
+        if failed:
+            print "Not filed: %s" % ', '.join(failed)
 
     def search_repo_requests(self, args):
         self._init_git_remote()
@@ -772,138 +1233,651 @@ class PySkein:
             self.gitremote.revoke_repo_request(args.id, name)
 
     def grant_request(self, args):
+        """Grant one or more new repo requests: create the remote repo and team,
+        add the package to koji, create the lookaside dir and close the request.
+        Requests are confirmed once, then granted concurrently.
+
+        :param list args.id: request ids
+        :param bool args.all (optional): grant every open new repo request
+        :param int args.jobs (optional): number of requests handled at once
+        """
 
         self._init_git_remote()
 
-        tag = None
+        tag = self.cfgs['koji']['latest_tag']
         if args.tag:
             tag = args.tag
 
-        name, summary, url, gitowner = self.gitremote.show_request_by_id(args.id)
+        ids = list(args.id)
+        if args.all:
+            ids.extend([str(i) for i in self.gitremote.list_repo_requests('open') if str(i) not in ids])
+        if not ids:
+            raise SkeinError("Please supply one or more request ids, or --all")
 
         try:
             kojiowner = self.cfgs['koji']['owner']
         except:
-            pass
+            kojiowner = None
 
         if args.kojiowner:
             kojiowner = args.kojiowner
-        if args.gitowner:
-            gitowner = args.gitowner
-
-        if not self.gitremote.request_is_open(args.id):
-            raise SkeinError("Request for '%s' is already completed...\n     Move along, nothing to see here!" % name)
 
-        print "Name: %s\nSummary: %s\nURL: %s\n" % (name, summary, url)
+        workers = self._jobs(args)
+
+        def _details(request_id):
+            remote = self._thread_git_remote()
+            name, summary, url, gitowner = remote.show_request_by_id(request_id)
+            return name, summary, url, gitowner, remote.request_is_open(request_id)
+
+        requests = []
+        for request_id, details, e in self._map(_details, ids, workers):
+            if e:
+                print "Request %s: %s" % (request_id, e)
+                continue
+            name, summary, url, gitowner, is_open = details
+            if not is_open:
+                print "Request %s for '%s' is already completed, skipping" % (request_id, name)
+                continue
+            if args.gitowner:
+                gitowner = args.gitowner
+            requests.append((request_id, name, summary, url, gitowner))
+
+        if not requests:
+            raise SkeinError("No open requests to grant...\n     Move along, nothing to see here!")
+
+        for request_id, name, summary, url, gitowner in requests:
+            print "#%s\nName: %s\nSummary: %s\nURL: %s\n" % (request_id, name, summary, url)
         valid = 'n'
-        valid = raw_input("Is the above information correct? (y/N) ")
+        if len(requests) == 1:
+            valid = raw_input("Is the above information correct? (y/N) ")
+        else:
+            valid = raw_input("Is the above information correct for all %d requests? (y/N) " % len(requests))
 
-        if valid.lower() == 'y':
-            kojiconfig = None
-            if args.config:
-                kojiconfig = args.config
+        if valid.lower() != 'y':
+            return
 
-            self._init_koji(user=self.cfgs['koji']['username'], kojiconfig=kojiconfig)
-            self._enable_pkg(name, summary, url, gitowner, kojiowner, tag)
-            self._create_lookaside_dir(name)
-            self.gitremote.close_repo_request(args.id, name)
+        kojiconfig = None
+        if args.config:
+            kojiconfig = args.config
 
-    def do_extract_pkg(self, args):
-        """Extract a package. Copies the spec, sources and patches appropriately 
-        in preparation for a commit and push (skein push) and upload to the lookaside 
-        cache (skein upload)
+        self._init_koji(user=self.cfgs['koji']['username'], kojiconfig=kojiconfig)
 
-        :param str args.path: path to source rpm
-        :param str args.message (optional): commit message
+        # teams are then found in the local index instead of the
+        # organization's full team list being fetched for every package
+        self.gitremote.sync_teams()
+
+        # koji and the lookaside are handled in a couple of batched calls
+        # while the per-package github work runs on the thread pool
+        failed = self._tag_pkgs(tag, [(name, kojiowner) for request_id, name, summary, url, gitowner in requests])
+        try:
+            self._create_lookaside_dirs([name for request_id, name, summary, url, gitowner in requests if not failed.has_key(name)])
+        except SkeinError as e:
+            for request_id, name, summary, url, gitowner in requests:
+                failed.setdefault(name, e)
+
+        def _grant(request):
+            request_id, name, summary, url, gitowner = request
+            self._enable_pkg_remote(name, summary, url, gitowner)
+            self._thread_git_remote().close_repo_request(request_id, name)
+
+        results = self._map(_grant, [r for r in requests if not failed.has_key(r[1])], workers)
+        for (request_id, name, summary, url, gitowner), result, e in results:
+            if e:
+                failed[name] = e
+
+        for name, e in failed.items():
+            self.logger.error("  granting '%s' failed: %s" % (name, e))
+            print "Granting '%s' failed: %s" % (name, e)
+        print "%d of %d request(s) granted" % (len(requests) - len(failed), len(requests))
+
+        if failed:
+            raise SkeinError("%d request(s) could not be granted, see skein.log for more information" % len(failed))
+
+    def _jobs(self, args):
+        """Number of workers per pipeline stage, from -j or skein.cfg
+
+        :param int args.jobs (optional): workers per stage
         """
 
-        for p in args.path:
-            srpms = self._get_srpm_list(p)
+        jobs = getattr(args, 'jobs', None)
+        if not jobs:
+            jobs = self.cfgs['skein'].get('jobs', 1)
+        return int(jobs)
 
-            for srpm in srpms:
-                self.logger.info("== Extracting %s ==" % (srpm))
-                print "Extracting %s" % (srpm)
-                self._set_srpm_details(u"%s" % (srpm))
-                self._install_srpm(u"%s" % (srpm))
+    def _state_path(self, name):
+        return "%s/%s/state.json" % (self.cfgs['skein']['proj_dir'], name)
 
-                proj_dir = "%s/%s" % (self.cfgs['skein']['proj_dir'], self.rpminfo['name'])
-#                print "spec_dest: %s" % proj_dir
+    def _load_state(self, name):
+        """Return the recorded state of a package's last extract, or None
 
-                self._makedir("%s/%s" % (proj_dir, self.cfgs['skein']['lookaside_dir']))
-                self._makedir("%s/%s" % (proj_dir, self.cfgs['skein']['git_dir']))
+        :param str name: package name
+        """
+
+        try:
+            f = open(self._state_path(name))
+        except IOError:
+            return None
+        try:
+            try:
+                return json.load(f)
+            except ValueError, e:
+                self.logger.info("  ignoring unreadable state for '%s': %s" % (name, e))
+                return None
+        finally:
+            f.close()
+
+    def _save_state(self, name, state):
+        """Record the state of a package, replacing the file in one rename
+
+        :param str name: package name
+        :param dict state: nevr, srpm digest and generated file hashes
+        """
+
+        path = self._state_path(name)
+        tmp = "%s.partial" % path
+        f = open(tmp, 'w')
+        try:
+            json.dump(state, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(tmp, path)
 
-#                self._init_git_repo("%s/%s" % (proj_dir, self.cfgs['skein']['git_dir']), self.rpminfo['name'])
+    def _srpm_digest(self, srpm, rpminfo):
+        # catalog entries made before the digest was recorded fall back to
+        # a (cached) hash of the whole file
+        return rpminfo.get('digest') or hash_files([srpm], self._hash_cache())[srpm]
 
-                # copy sources, both archives and patches. Archives go to lookaside_dir, patches and other sources go to git_dir
-                src_dest = "%s/%s" % (proj_dir, self.cfgs['skein']['lookaside_dir'])
-                git_dest = "%s/%s" % (proj_dir, self.cfgs['skein']['git_dir'])
+    def _git_files(self, git_dest):
+        """sha256 of every file skein writes into git_dest"""
 
-                self._extract_srpm(src_dest, git_dest)
-                self._generate_sha256(src_dest, git_dest)
-                self._update_gitignore(git_dest)
-                self._do_makefile(git_dest)
+        paths = ["%s/%s" % (git_dest, f) for f in os.listdir(git_dest)
+                if f != '.git' and os.path.isfile("%s/%s" % (git_dest, f))]
+        sums = hash_files(paths, self._hash_cache(), int(self.cfgs['skein'].get('hash_workers', 4)))
+        return dict((os.path.basename(path), sha) for path, sha in sums.items())
+
+    def _file_stats(self, git_dest, files):
+        """[size, mtime] of each of files in git_dest, for the cheap half of _unchanged"""
+
+        stats = {}
+        for f in files:
+            st = os.stat("%s/%s" % (git_dest, f))
+            stats[f] = [st.st_size, st.st_mtime]
+        return stats
+
+    def _nevr(self, rpminfo):
+        return "%s-%s:%s-%s" % (rpminfo['name'], rpminfo.get('epoch') or 0, rpminfo['version'], rpminfo['release'])
+
+    def _unchanged(self, job, imported=False):
+        """True if job's srpm is the one last extracted (and, if imported is
+        set, imported) for its package, and nothing skein generated from it
+        has been touched since
+
+        :param ImportJob job: job with rpminfo set
+        :param bool imported: also require the last import to have finished
+        """
+
+        state = self._load_state(job.name)
+        if not state or state.get('nevr') != self._nevr(job.rpminfo):
+            return False
+        if imported and not state.get('imported'):
+            return False
+        if state.get('digest') != self._srpm_digest(job.srpm, job.rpminfo):
+            return False
+
+        proj_dir = "%s/%s" % (self.cfgs['skein']['proj_dir'], job.name)
+        src_dest = "%s/%s" % (proj_dir, self.cfgs['skein']['lookaside_dir'])
+        for src in state.get('archives', []):
+            if not os.path.isfile("%s/%s" % (src_dest, src)):
+                return False
+
+        # a file whose size and mtime are as recorded is taken as unchanged;
+        # only the others are hashed
+        git_dest = "%s/%s" % (proj_dir, self.cfgs['skein']['git_dir'])
+        files = state.get('files', {})
+        stats = state.get('stats', {})
+        suspect = []
+        for f in files:
+            try:
+                st = os.stat("%s/%s" % (git_dest, f))
+            except OSError:
+                return False
+            if stats.get(f) != [st.st_size, st.st_mtime]:
+                suspect.append("%s/%s" % (git_dest, f))
+        if suspect:
+            sums = hash_files(suspect, self._hash_cache(), int(self.cfgs['skein'].get('hash_workers', 4)))
+            for path, sha in sums.items():
+                if files[os.path.basename(path)] != sha:
+                    return False
+        return True
+
+    def _journal(self):
+        """Open the stage journal named by journal in skein.cfg, once
+
+        """
+
+        with self._lock:
+            if not getattr(self, 'journal', None):
+                self.journal = Journal(self.cfgs['skein'].get('journal',
+                        os.path.join(self.cfgs['skein']['install_root'], 'journal.jsonl')))
+        return self.journal
+
+    def _journal_stage(self, job, stage):
+        self._journal().record(job.srpm, self._srpm_digest(job.srpm, job.rpminfo), job.name, stage)
+
+    def _query_stage(self, job, imported=False):
+        job.rpminfo = self._get_srpm_details(u"%s" % (job.srpm))
+
+        job.proj_dir = "%s/%s" % (self.cfgs['skein']['proj_dir'], job.name)
+        # copy sources, both archives and patches. Archives go to lookaside_dir, patches and other sources go to git_dir
+        job.src_dest = "%s/%s" % (job.proj_dir, self.cfgs['skein']['lookaside_dir'])
+        job.git_dest = "%s/%s" % (job.proj_dir, self.cfgs['skein']['git_dir'])
+
+        if job.resume:
+            job.resumed = self._journal().completed(job.srpm, self._srpm_digest(job.srpm, job.rpminfo))
+            if job.resumed:
+                self.logger.info("  resuming %s after %s" % (job.srpm, ', '.join(sorted(job.resumed))))
+        else:
+            self._journal_stage(job, 'start')
+
+        if not job.force and self._unchanged(job, imported):
+            self.logger.info("  %s already %s at %s, skipping" % (job.srpm, imported and 'imported' or 'extracted',
+                    self._nevr(job.rpminfo)))
+            job.skipped = True
+
+    def _import_query_stage(self, job):
+        self._query_stage(job, imported=True)
+
+    def _extract_stage(self, job):
+        self.logger.info("== Extracting %s ==" % (job.srpm))
+        print "Extracting %s" % (job.srpm)
+
+        self._makedir(job.src_dest)
+        self._makedir(job.git_dest)
+
+        self._extract_srpm(u"%s" % (job.srpm), job.rpminfo, job.src_dest, job.git_dest)
+
+    def _hash_stage(self, job):
+        self._generate_sha256(job.rpminfo, job.src_dest, job.git_dest)
+        self._update_gitignore(job.rpminfo, job.git_dest)
+        self._do_makefile(job.rpminfo, job.git_dest)
+
+        source_exts = self.cfgs['skein']['source_exts'].split(',')
+        files = self._git_files(job.git_dest)
+        self._save_state(job.name, {
+            'nevr': self._nevr(job.rpminfo),
+            'srpm': os.path.abspath(job.srpm),
+            'digest': self._srpm_digest(job.srpm, job.rpminfo),
+            'archives': [src for src in job.rpminfo['sources'] if src.rsplit('.')[-1] in source_exts],
+            'files': files,
+            'stats': self._file_stats(job.git_dest, files),
+            'imported': False,
+        })
+
+    def _commit_stage(self, job):
+        job.repo = self._commit_pkg(job.name, job.message)
+
+    def _upload_stage(self, job):
+        self._upload_source(job.name)
+
+    def _push_stage(self, job):
+        self._push_to_remote(job.name, job.message, repo=job.repo)
+
+        state = self._load_state(job.name)
+        if state:
+            state['imported'] = True
+            self._save_state(job.name, state)
+
+    def _run_pipeline(self, args, stages, message=None):
+        """Run every srpm named in args.path through the given stages
+
+        :param str args.path: path(s) to source rpm(s) or directories of them
+        :param list stages: (name, method) pairs, run in order
+        :param str message: commit message handed to each job
+        :returns: list of finished ImportJob objects
+        """
+
+        srpms = []
+        for p in args.path:
+            srpms.extend(self._get_srpm_list(p))
+
+        workers = self._jobs(args)
+        self._scan_srpms(srpms, workers)
+
+        jobs = []
+        for srpm in srpms:
+            job = ImportJob(srpm)
+            job.message = message
+            job.force = getattr(args, 'force', False)
+            job.resume = getattr(args, 'resume', False)
+            jobs.append(job)
+
+        self.logger.info("== Processing %d srpm(s) with %d worker(s) per stage ==" % (len(jobs), workers))
+        pipeline = Pipeline([Stage(name, func, workers) for name, func in stages], self.logger, key=lambda job: job.name,
+                on_complete=self._journal_stage)
+        done = pipeline.run(jobs)
+
+        failed = [job for job in done if job.failed]
+        for job in failed:
+            stage, e = job.error
+            print "  %s: failed in '%s': %s" % (job, stage, e)
+        skipped = len([job for job in done if job.skipped])
+        self.logger.info("== %d of %d srpm(s) completed, %d unchanged ==" % (len(done) - len(failed), len(jobs), skipped))
+        print "%d of %d srpm(s) completed, %d unchanged" % (len(done) - len(failed), len(jobs), skipped)
+
+        if failed:
+            raise SkeinError("%d srpm(s) failed, see skein.log for more information" % len(failed))
+
+        # nothing from this run will need resuming
+        kept = self._journal().compact([(job.srpm, self._srpm_digest(job.srpm, job.rpminfo)) for job in done])
+        self.logger.info("  journal compacted, %d unfinished srpm(s) from earlier runs kept" % kept)
+
+        return done
+
+    def do_extract_pkg(self, args):
+        """Extract a package. Copies the spec, sources and patches appropriately 
+        in preparation for a commit and push (skein push) and upload to the lookaside 
+        cache (skein upload)
+
+        :param str args.path: path to source rpm
+        :param int args.jobs (optional): workers per stage
+        :param bool args.force (optional): extract srpms already extracted at the same version
+        :param bool args.resume (optional): skip stages the journal says an earlier run completed
+        """
+
+        self._run_pipeline(args, [('query', self._query_stage),
+                                  ('extract', self._extract_stage),
+                                  ('hash', self._hash_stage)])
 
     def do_push(self, args):
-        """Push to remote git repository
+        """Push one or more packages to their remote git repositories,
+        several at a time
 
-        :param str args.name: repository name
+        :param list args.name: repository names
+        :param bool args.all (optional): push every package under proj_dir
         :param str args.message (optional): commit message
+        :param int args.jobs (optional): pushes run at once
         """
 
-        name = args.name
-        message = None
-        if args.message:
-            message = args.message
+        if args.all:
+            names = self._list_pkgs()
+        else:
+            names = args.name
+        if not names:
+            raise SkeinError("No packages to push, name one or more or use --all")
+
+        message = args.message
+        if not message:
+            # asked for at most once, by whichever repo first needs it
+            message = self._lazy_commit_message()
+
+        self.logger.info("== Pushing %d git repo(s) ==" % len(names))
+        print "Pushing %d git repo(s)" % len(names)
+
+        # formatting a url needs no connection, so one remote serves every thread
+        if not getattr(self, 'gitremote', None):
+            self._init_git_remote()
+        scm_urls = dict((name, self.gitremote.get_scm_url(name)) for name in names)
+
+        failed = 0
+        counts = {}
+        def _push(name):
+            with metrics.span(name, 'push'):
+                return self._push_pkg(name, scm_urls[name], message)
+
+        for name, result, e in self._map(_push, names, self._jobs(args)):
+            if e:
+                failed += 1
+                self.logger.info("  '%s' push failed: %s" % (name, e))
+                print "  %s: failed: %s" % (name, e)
+            else:
+                counts[result] = counts.get(result, 0) + 1
+                print "  %s: %s" % (name, result)
 
-        self._push_to_remote(name, message)
+        print "%d pushed, %d up to date, %d failed" % (counts.get('pushed', 0), counts.get('up to date', 0), failed)
+        if failed:
+            raise SkeinError("%d of %d push(es) failed" % (failed, len(names)))
 
     def do_upload(self, args):
         """Upload source(s) to lookaside cache
 
         :param str args.name: repository name
+        :param bool args.full: upload every archive, skipping the manifest check
         """
 
         name = args.name
-        self._upload_source(name)
+        self._upload_source(name, args.full)
 
     def do_import_pkg(self, args):
-        """Import a package. Performs extract, push and upload (in that order)
+        """Import a package. Performs extract, commit, upload and push (in that order)
+        for every srpm, with the stages overlapping across packages
 
         :param str args.path: path to source rpm
         :param str args.message (optional): commit message
+        :param int args.jobs (optional): workers per stage
+        :param bool args.force (optional): import srpms already imported at the same version
+        :param bool args.resume (optional): skip stages the journal says an earlier run completed
         """
 
-        self.do_extract_pkg(args)
+        message = args.message
+        if not message:
+            # asked for at most once, by whichever package first has
+            # something to commit; unchanged srpms never ask
+            message = self._lazy_commit_message()
+
+        self._init_git_remote()
+        self._run_pipeline(args, [('query', self._import_query_stage),
+                                  ('extract', self._extract_stage),
+                                  ('hash', self._hash_stage),
+                                  ('commit', self._commit_stage),
+                                  ('upload', self._upload_stage),
+                                  ('push', self._push_stage)], message)
+
+
+    def _history_files(self, srpm, rpminfo, sources_dest=None):
+        """Read the files one version of a package contributes to its git tree,
+        straight from the srpm payload
 
-        name = self.rpminfo['name']
-        message = None
-        if args.message:
-            message = args.message
+        :param str srpm: path to srpm
+        :param dict rpminfo: srpm details from _get_srpm_details
+        :param str sources_dest: if set, archives are also written here
+        :returns: list of (path, mode, content) tuples
+        """
+
+        import hashlib
 
-        self._upload_source(name)
-        self._push_to_remote(name, message)
+        source_exts = self.cfgs['skein']['source_exts'].split(',')
+        archives = [src for src in rpminfo['sources'] if src.rsplit('.')[-1] in source_exts]
+
+        files = []
+        sums = {}
+        for entry in rpmfile.payload_entries(srpm, rpminfo):
+            name = os.path.basename(entry.name)
+            if not name or (entry.mode & 0170000) != 0100000:
+                continue
+
+            if name not in archives:
+                files.append((name, entry.mode & 0100 and 0100755 or 0100644, entry.read(entry.size)))
+                continue
+
+            # archives are only hashed (and optionally kept), never committed
+            h = hashlib.sha256()
+            out = None
+            if sources_dest:
+                out = open("%s/.%s.partial" % (sources_dest, name), 'wb')
+            data = entry.read()
+            while data:
+                h.update(data)
+                if out:
+                    out.write(data)
+                data = entry.read()
+            if out:
+                out.close()
+                os.rename("%s/.%s.partial" % (sources_dest, name), "%s/%s" % (sources_dest, name))
+            sums[name] = h.hexdigest()
+
+        missing = [src for src in archives if not sums.has_key(src)]
+        if missing:
+            raise SkeinError("%s does not contain %s" % (srpm, ', '.join(missing)))
+
+        files.append(('sources', 0100644, ''.join(["%s *%s\n" % (sums[src], src) for src in archives])))
+        files.append(('.gitignore', 0100644, self._gitignore_content(rpminfo)))
+        files.append(('Makefile', 0100644, self._makefile_content(rpminfo)))
+        return files
+
+    def do_history(self, args):
+        """Import every version of a package in one pass, oldest first, by
+        streaming each srpm's spec, patches, sources, .gitignore and Makefile
+        into 'git fast-import'. The working tree is only updated once, at the end.
+
+        :param str args.path: paths to the package's srpms, or directories of them
+        :param bool args.sources (optional): also write each version's archives to the lookaside dir
+        """
 
+        import rpm
+
+        srpms = []
+        for p in args.path:
+            srpms.extend(self._get_srpm_list(p))
+        self._scan_srpms(srpms, self._jobs(args))
+
+        versions = [(self._get_srpm_details(srpm), srpm) for srpm in srpms]
+        names = set([rpminfo['name'] for rpminfo, srpm in versions])
+        if len(names) != 1:
+            raise SkeinError("history imports one package at a time, found: %s" % ', '.join(sorted(names)))
+        name = names.pop()
+
+        def _nevr(rpminfo):
+            return (str(rpminfo.get('epoch') or 0), rpminfo['version'], rpminfo['release'])
+        versions.sort(lambda a, b: rpm.labelCompare(_nevr(a[0]), _nevr(b[0])))
+
+        proj_dir = "%s/%s" % (self.cfgs['skein']['proj_dir'], name)
+        git_dest = "%s/%s" % (proj_dir, self.cfgs['skein']['git_dir'])
+        src_dest = "%s/%s" % (proj_dir, self.cfgs['skein']['lookaside_dir'])
+        self._makedir(git_dest)
+        self._makedir(src_dest)
+        self._init_git_repo(git_dest, name)
+
+        old = self._git(git_dest, ['rev-parse', '-q', '--verify', 'HEAD'], check=False)
+        clean = not self._git_status(git_dest)
+        committer = self._git(git_dest, ['var', 'GIT_COMMITTER_IDENT']).strip()
+
+        self.logger.info("== Importing %d version(s) of '%s' with git fast-import ==" % (len(versions), name))
+        print "Importing %d version(s) of '%s'" % (len(versions), name)
+
+        fi = FastImport(git_dest)
+        parent = old and "%s^0" % fi.ref
+        try:
+            for rpminfo, srpm in versions:
+                self.logger.info("  %s-%s-%s from %s" % (name, rpminfo['version'], rpminfo['release'], srpm))
+                print "  %s-%s-%s" % (name, rpminfo['version'], rpminfo['release'])
+                message = "import %s-%s-%s\n\nsrpm imported for '%s %s'\n" % (name, rpminfo['version'], rpminfo['release'],
+                        self.cfgs['skein']['distro'], self.cfgs['skein']['version'])
+                files = self._history_files(srpm, rpminfo, getattr(args, 'sources', False) and src_dest)
+                fi.commit(committer, message, files, parent)
+                parent = None
+        except:
+            # leave master as it was rather than with part of the history
+            fi.abort()
+            raise
+        fi.close()
+
+        # bring the working tree up to the last version, unless it has
+        # changes of its own that this would clobber
+        if not clean:
+            print "'%s' has uncommitted changes, working tree not updated" % git_dest
+        elif old:
+            self._git(git_dest, ['read-tree', '-m', '-u', old.strip(), 'HEAD'])
+        else:
+            self._git(git_dest, ['read-tree', '--reset', '-u', 'HEAD'])
+
+        self.logger.info("  '%s' history imported" % name)
 
     def do_build_pkg(self, args):
+        """Submit koji builds of one or more imported packages, checking the
+        target once and sending the builds in multicall batches
+
+        :param str args.target: build target
+        :param list args.name: package names
+        :param str args.file (optional): file of package names, one per line
+        :param bool args.all (optional): build every package under proj_dir
+        :param int args.priority (optional): koji priority of the builds
+        :param str args.tasks_file (optional): write 'task_id name' lines here
+        :param bool args.nowait (optional): don't watch the builds
+        :param str args.config (optional): alternate koji config file
+        """
 
-        kojiconfig = None
-        if args.config:
-            kojiconfig = args.config
+        if args.all:
+            names = self._list_pkgs()
+        else:
+            names = list(args.name)
+            if args.file:
+                f = open(args.file)
+                names.extend([line.split()[0] for line in f if line.strip() and not line.startswith('#')])
+                f.close()
+        if not names:
+            raise SkeinError("No packages to build, name one or more, or use --file or --all")
 
-        self.logger.info("== Attempting to build '%s' for target '%s' ==" % (args.name, args.target))
-        print "Attempting to build '%s' for target '%s'" % (args.name, args.target)
+        priority = args.priority
+        if priority is None:
+            priority = int(self.cfgs['koji'].get('build_priority', 5))
 
-        self._init_koji(user=self.cfgs['koji']['username'], kojiconfig=kojiconfig)
-        build_target = self.kojisession.getBuildTarget(args.target)
+        self.logger.info("== Attempting to build %d package(s) for target '%s' ==" % (len(names), args.target))
+        print "Attempting to build %d package(s) for target '%s'" % (len(names), args.target)
+
+        self._init_koji(user=self.cfgs['koji']['username'], kojiconfig=args.config)
+        with metrics.span('koji', 'build'):
+            self._check_build_target(args.target)
+            submitted = self._submit_builds(args.target, names, priority)
+        self.kojisession.logout()
+
+        task_ids = []
+        failed = 0
+        for name, task_id, e in submitted:
+            if e:
+                failed += 1
+                self.logger.info("  '%s' build not submitted: %s" % (name, e))
+                print "  %s: failed: %s" % (name, e)
+            else:
+                task_ids.append(task_id)
+                self.logger.info("  '%s' build submitted, task %s" % (name, task_id))
+                print "  %s: Task URL: %s/%s?taskID=%s" % (name, 'http://koji.gooselinux.org/koji', 'taskinfo', task_id)
+
+        print "%d submitted, %d failed" % (len(task_ids), failed)
+
+        if args.tasks_file:
+            f = open(args.tasks_file, 'w')
+            for name, task_id, e in submitted:
+                if not e:
+                    f.write("%s %s\n" % (task_id, name))
+            f.close()
+            self.logger.info("  task ids written to '%s'" % args.tasks_file)
+            print "Task ids written to '%s', follow them with 'skein watch --file %s'" % (args.tasks_file, args.tasks_file)
+
+        rv = 0
+        if task_ids and not args.nowait:
+            with metrics.span('koji', 'watch'):
+                rv = self._watch_koji_tasks(self.kojisession, task_ids, quiet=len(task_ids) > 1)
 
-        #print "Args.Target: %s" % args
-        #print "Build Target: %s" % build_target
+        if failed:
+            raise SkeinError("%d build(s) could not be submitted, see skein.log for more information" % failed)
+        if rv:
+            raise SkeinError("One or more builds failed, see skein.log for more information")
+
+    def _check_build_target(self, target):
+        """Make sure target exists and its destination tag is open for builds
+
+        :param str target: build target
+        :returns: the target's info
+        """
+
+        metrics.count(rpcs=1)
+        build_target = self.kojisession.getBuildTarget(target)
 
         if not build_target:
-            raise SkeinError('Unknown build target: %s' % args.target)
+            raise SkeinError('Unknown build target: %s' % target)
 
+        metrics.count(rpcs=1)
         dest_tag = self.kojisession.getTag(build_target['dest_tag_name'])
-        #print "Dest Tag: %s" % dest_tag
 
         if not dest_tag:
             raise SkeinError('Unknown destination tag %s' %
@@ -912,35 +1886,250 @@ class PySkein:
         if dest_tag['locked']:
             raise SkeinError('Destination tag %s is locked' % dest_tag['name'])
 
+        return build_target
+
+    def _submit_builds(self, target, names, priority=5):
+        """Submit a build of each package, multicall_batch builds per round trip
+
+        :param str target: build target, already checked
+        :param list names: package names
+        :param int priority: koji priority of the builds
+        :returns: list of (name, task_id, error) tuples, error None on success
+        """
+
         opts = {}
-        priority = 5
+        calls = [('build', ('%s/%s.git#HEAD' % (self.cfgs['github']['anon_base'], name), target, opts),
+                {'priority': priority}) for name in names]
 
-        task_id = self.kojisession.build('%s/%s.git#HEAD' % (self.cfgs['github']['anon_base'], args.name), args.target, opts, priority=priority)
+        submitted = []
+        for name, result in zip(names, self._koji_multicall(self.kojisession, calls, strict=False)):
+            if isinstance(result, dict):
+                submitted.append((name, None, result.get('faultString')))
+            else:
+                submitted.append((name, result, None))
+        return submitted
 
-        #print "Task-ID: %s" % task_id
-        print "Task URL: %s/%s?taskID=%s" % ('http://koji.gooselinux.org/koji', 'taskinfo', task_id) 
+    def _get_rpm_list(self, path):
+        """Binary rpms in path, or in any directory below it
 
-        self.kojisession.logout()
+        :param str path: rpm, or directory of rpms such as a yum repository
+        """
 
-        if not args.nowait:
-            self._watch_koji_tasks(self.kojisession, [task_id])
+        if os.path.isfile(path):
+            return [path]
+        if not os.path.isdir(path):
+            raise SkeinError("'%s' is not valid" % path)
+        rpms = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            rpms.extend([os.path.join(dirpath, f) for f in filenames
+                    if f.endswith('.rpm') and not f.endswith('.src.rpm')])
+        return sorted(rpms)
+
+    def _provides_index(self, rpminfos, tag=None, rpm_paths=()):
+        """Index what the srpms, binary rpms and the packages already in
+        tag provide
+
+        :param list rpminfos: srpm details from the catalog
+        :param str tag (optional): koji tag whose latest rpms are indexed,
+                                   binary package names by their source
+        :param list rpm_paths (optional): binary rpms, or directories of them,
+                                          whose provides and files are indexed
+        :returns: ProvidesIndex
+        """
 
-    def list_deps(self, args):
+        index = ProvidesIndex()
+        for rpminfo in rpminfos:
+            index.add(rpminfo['name'], [rpminfo['name']])
+
+        rpms = []
+        for path in rpm_paths:
+            rpms.extend(self._get_rpm_list(path))
+        if rpms:
+            catalog = self._rpm_catalog()
+            rpms = self._scan_srpms(rpms, int(self.cfgs['skein'].get('jobs', 1)), catalog)
+            for path in rpms:
+                rpminfo = catalog.lookup(path)
+                index.add(rpminfo['source'], rpminfo['provides'])
+            self.logger.info("  %d binary rpm(s) indexed" % len(rpms))
+
+        if tag:
+            metrics.count(rpcs=1)
+            rpms, builds = self.kojisession.listTaggedRPMS(tag, inherit=True, latest=True)
+            sources = dict((build['id'], build['package_name']) for build in builds)
+            for r in rpms:
+                if sources.has_key(r['build_id']):
+                    index.add(sources[r['build_id']], [r['name']])
+            self.logger.info("  %d rpm(s) from %d build(s) in '%s' indexed" % (len(rpms), len(builds), tag))
+
+        return index
+
+    def do_schedule(self, args):
+        """Build a set of packages in dependency order, each as soon as the
+        packages it BuildRequires are built and in the buildroot repo
+
+        :param str args.target: build target
+        :param list args.path: srpms, or directories of them, of the packages
+        :param list args.rpms (optional): binary rpms, or directories of
+                                          them, whose provides count too
+        :param bool args.dry_run (optional): only show the build order
+        :param bool args.allow_cycles (optional): build packages that
+                                                  depend on each other together
+        :param int args.priority (optional): koji priority of the builds
+        :param str args.config (optional): alternate koji config file
+        """
 
-        path = args.path
-        srpms = self._get_srpm_list(path)
+        srpms = []
+        for path in args.path:
+            srpms.extend(self._get_srpm_list(path))
+        # srpms whose headers can't be read are reported and left out
+        srpms = self._scan_srpms(srpms, int(self.cfgs['skein'].get('jobs', 1)))
 
+        # the last srpm of a name wins
+        rpminfos = {}
         for srpm in srpms:
-            self._set_srpm_details(u"%s" % (srpm))
+            rpminfo = self._catalog().lookup(srpm)
+            rpminfos[rpminfo['name']] = rpminfo
+
+        user = None
+        if not args.dry_run:
+            user = self.cfgs['koji']['username']
+        self._init_koji(user=user, kojiconfig=args.config)
+        build_target = self._check_build_target(args.target)
+        build_tag = build_target['build_tag_name']
+
+        self.logger.info("== Ordering %d package(s) for target '%s' ==" % (len(rpminfos), args.target))
+        print "Ordering %d package(s) for target '%s'" % (len(rpminfos), args.target)
+
+        index = self._provides_index(rpminfos.values(), build_tag, args.rpms or ())
+        graph = BuildGraph(dict((name, build_requires(rpminfo)) for name, rpminfo in rpminfos.items()), index)
+
+        waves = graph.waves()
+        for i, wave in enumerate(waves):
+            names = [len(group) > 1 and "(%s)" % ' '.join(group) or group[0] for group in wave]
+            self.logger.info("  wave %d: %s" % (i + 1, ' '.join(names)))
+            print "  wave %d: %s" % (i + 1, ' '.join(names))
+        for name in sorted(graph.missing):
+            if graph.missing[name]:
+                self.logger.info("  %s: nothing provides %s" % (name, ', '.join(sorted(graph.missing[name]))))
+        missing = len([name for name in graph.missing if graph.missing[name]])
+        print "%d package(s) in %d wave(s), %d with BuildRequires nothing provides (see skein.log)" % (len(rpminfos), len(waves), missing)
+
+        cycles = graph.cycles()
+        for group in cycles:
+            self.logger.info("  cycle: %s" % ' '.join(group))
+            print "  cycle: %s" % ' '.join(group)
+        if cycles and not args.allow_cycles:
+            raise SkeinError("%d dependency cycle(s), use --allow-cycles to build each cycle's packages together" % len(cycles))
+
+        if args.dry_run:
+            return
+
+        priority = args.priority
+        if priority is None:
+            priority = int(self.cfgs['koji'].get('build_priority', 5))
 
-            self.logger.info("== Getting deps for %s==" % (srpm))
-            print "Getting dependencies for %s" % (srpm)
+        watcher = self._tree_watcher(self.kojisession, quiet=True)
+        scheduler = BuildScheduler(graph, lambda names: self._submit_builds(args.target, names, priority),
+                watcher, build_tag, repo_interval=self.cfgs['koji'].get('repo_interval', 30),
+                status_interval=self.cfgs['koji'].get('watch_status_interval', 10))
 
-            for br in self.buildrequires:
-                self.logger.info("  %s" % br)
-                print "  %s" % br
+        try:
+            with metrics.span('koji', 'schedule'):
+                built, failed, skipped = scheduler.run()
+        except (KeyboardInterrupt):
+            msg = "\nScheduling stopped, no more builds will be submitted. Running Tasks: %s" % watcher.running()
+            self.logger.info(msg)
+            print msg
+            return
+        finally:
+            self.kojisession.logout()
+
+        print "%d built, %d failed, %d skipped" % (len(built), len(failed), len(skipped))
+        if failed or skipped:
+            raise SkeinError("Builds failed: %s, see skein.log for more information" % ' '.join(failed))
+
+    def do_watch(self, args):
+        """Watch koji tasks, and every task they spawn, until all are done
+
+        :param list args.task_id: top level task ids
+        :param str args.file (optional): file of task ids, one per line
+        :param bool args.verbose (optional): show every task's state changes,
+                                             not only the top level ones
+        :param str args.config (optional): alternate koji config file
+        """
+
+        task_ids = list(args.task_id)
+        if args.file:
+            f = open(args.file)
+            task_ids.extend([line.split()[0] for line in f if line.strip() and not line.startswith('#')])
+            f.close()
+        if not task_ids:
+            raise SkeinError("Please supply one or more task ids, or --file")
+
+        try:
+            task_ids = [int(task_id) for task_id in task_ids]
+        except ValueError as e:
+            raise SkeinError("Task ids must be numbers: %s" % e)
+
+        # watching needs no login
+        self._init_koji(kojiconfig=args.config)
+        with metrics.span('koji', 'watch'):
+            rv = self._watch_koji_tasks(self.kojisession, task_ids, quiet=not args.verbose)
+        if rv:
+            raise SkeinError("One or more tasks failed, see skein.log for more information")
+
+    def list_deps(self, args):
+        """Resolve the BuildRequires of a tree of srpms against what the
+        srpms, any binary rpms given and optionally a koji tag provide
+
+        :param list args.path: srpms, or directories of them
+        :param list args.rpms (optional): binary rpms, or directories of them
+        :param str args.tag (optional): koji tag whose latest rpms count too
+        :param bool args.verbose (optional): list every BuildRequires and its
+                                             providers, not just what is missing
+        :param str args.config (optional): alternate koji config file
+        """
+
+        srpms = []
+        for path in args.path:
+            srpms.extend(self._get_srpm_list(path))
+        srpms = self._scan_srpms(srpms, int(self.cfgs['skein'].get('jobs', 1)))
+        rpminfos = dict((srpm, self._catalog().lookup(srpm)) for srpm in srpms)
+
+        if args.tag:
+            # reading a tag needs no login
+            self._init_koji(kojiconfig=args.config)
+
+        self.logger.info("== Resolving BuildRequires of %d srpm(s) ==" % len(srpms))
+        print "Resolving BuildRequires of %d srpm(s)" % len(srpms)
+
+        index = self._provides_index(rpminfos.values(), args.tag, args.rpms or ())
+        satisfied, missing = index.resolve_all(dict((srpm, build_requires(rpminfo)) for srpm, rpminfo in rpminfos.items()))
+
+        needed_by = {}
+        for srpm in srpms:
+            for req in missing[srpm]:
+                needed_by[req] = needed_by.get(req, 0) + 1
+
+            if not args.verbose and not missing[srpm]:
+                continue
+            self.logger.info("== Dependencies of %s ==" % srpm)
+            print "Dependencies of %s" % srpm
+            if args.verbose:
+                for req in sorted(satisfied[srpm]):
+                    self.logger.info("  %s: %s" % (req, ' '.join(sorted(index.providers(req)))))
+                    print "  %s: %s" % (req, ' '.join(sorted(index.providers(req))))
+            for req in sorted(missing[srpm]):
+                self.logger.info("  %s: MISSING" % req)
+                print "  %s: MISSING" % req
             print ""
 
+        unmet = len([srpm for srpm in srpms if missing[srpm]])
+        print "%d srpm(s): %d with every BuildRequires satisfied, %d missing %d capabilities, %d capabilities indexed" % (
+                len(srpms), len(srpms) - unmet, unmet, len(needed_by), len(index))
+        for req, count in sorted(needed_by.items(), key=lambda item: (-item[1], item[0]))[:10]:
+            print "  %s: needed by %d srpm(s)" % (req, count)
+
 def main():
 
     ps = PySkein()
@@ -0,0 +1,311 @@
+import os
+import re
+import bz2
+import zlib
+import subprocess
+
+import metrics
+from errors import SkeinError, UnsupportedPayload
+
+CHUNK_SIZE = 1024 * 1024
+
+# cpio 'newc' header: magic followed by 13 hex encoded 8 character fields
+CPIO_HEADER_SIZE = 110
+CPIO_MAGIC = ('070701', '070702')
+CPIO_TRAILER = 'TRAILER!!!'
+
+# payloads we hand to an external decompressor, fed straight from the srpm
+EXTERNAL_DECOMPRESSORS = {
+    'xz': ['/usr/bin/xz', '-dc'],
+    'lzma': ['/usr/bin/xz', '--format=lzma', '-dc'],
+    'zstd': ['/usr/bin/zstd', '-dc'],
+}
+
+# files worth indexing as provides: the ones createrepo lists in
+# primary.xml, which is what file requirements almost always name
+PRIMARY_FILES = re.compile(r'.*bin/.*|^/etc/.*|^/usr/lib/sendmail$')
+
+def _read_hdr(path):
+    """Return the header of an rpm and the offset its payload starts at"""
+
+    # imported here so the catalog can answer without loading rpm
+    import rpm
+
+    ts = rpm.ts()
+    ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        try:
+            hdr = ts.hdrFromFdno(fd)
+        except rpm.error, e:
+            raise SkeinError("Unable to read header from '%s': %s" % (path, e))
+        # rpm leaves the descriptor at the start of the payload
+        return hdr, os.lseek(fd, 0, os.SEEK_CUR)
+    finally:
+        os.close(fd)
+
+def read_provides(path):
+    """Read what a binary rpm provides
+
+    :param str path: path to the rpm
+    :returns: dict of name, version, release, source (the name of the
+              package it was built from) and provides, its provided
+              capability names and primary files
+    """
+
+    import rpm
+
+    hdr, payload_offset = _read_hdr(path)
+
+    rpminfo = {}
+    rpminfo['name'] = hdr[rpm.RPMTAG_NAME]
+    rpminfo['version'] = hdr[rpm.RPMTAG_VERSION]
+    rpminfo['release'] = hdr[rpm.RPMTAG_RELEASE]
+    # foo-1.0-1.src.rpm
+    rpminfo['source'] = rpminfo['name']
+    if hdr[rpm.RPMTAG_SOURCERPM]:
+        rpminfo['source'] = hdr[rpm.RPMTAG_SOURCERPM].rsplit('-', 2)[0]
+    provides = set(hdr[rpm.RPMTAG_PROVIDENAME])
+    provides.update([f for f in hdr[rpm.RPMTAG_FILENAMES] if PRIMARY_FILES.match(f)])
+    provides.add(rpminfo['name'])
+    rpminfo['provides'] = sorted(provides)
+
+    return rpminfo
+
+def read_header(path):
+    """Read an SRPM header, recording where its payload starts
+
+    :param str path: path to the source RPM (SRPM)
+    :returns: dict of srpm details
+    """
+
+    import rpm
+
+    hdr, payload_offset = _read_hdr(path)
+
+    rpminfo = {}
+    rpminfo['name'] = hdr[rpm.RPMTAG_NAME]
+    rpminfo['version'] = hdr[rpm.RPMTAG_VERSION]
+    rpminfo['release'] = hdr[rpm.RPMTAG_RELEASE]
+    rpminfo['epoch'] = hdr[rpm.RPMTAG_EPOCH]
+    rpminfo['sources'] = hdr[rpm.RPMTAG_SOURCE]
+    patches = []
+    for patch in hdr[rpm.RPMTAG_PATCH]:
+        patches.append(patch.replace('%{name}', rpminfo['name']))
+    rpminfo['patches'] = patches
+    rpminfo['summary'] = hdr[rpm.RPMTAG_SUMMARY]
+    rpminfo['url'] = hdr[rpm.RPMTAG_URL]
+    # note to self, the [:-2] strips off the rpmlib(FileDigests)' and
+    #'rpmlib(CompressedFileNames)' which are provided by the 'rpm' rpm
+    rpminfo['buildrequires'] = hdr[rpm.RPMTAG_REQUIRES]
+    # md5 of header and payload from the signature header, identifying
+    # this exact build of the srpm without reading the payload
+    digest = hdr[rpm.RPMTAG_SIGMD5] or hdr[rpm.RPMTAG_SHA1HEADER]
+    if digest and len(digest) == 16:
+        digest = digest.encode('hex')
+    rpminfo['digest'] = digest
+    rpminfo['payload_offset'] = payload_offset
+    rpminfo['payload_compressor'] = hdr[rpm.RPMTAG_PAYLOADCOMPRESSOR] or 'gzip'
+    rpminfo['payload_format'] = hdr[rpm.RPMTAG_PAYLOADFORMAT] or 'cpio'
+
+    return rpminfo
+
+class _Stream(object):
+    """File-like decompressing reader over the payload of an SRPM"""
+
+    def __init__(self, path, offset, compressor):
+        self.f = open(path, 'rb')
+        self.f.seek(offset)
+        self.proc = None
+        # decompressed data not yet read starts at buf[pos]
+        self.buf = ''
+        self.pos = 0
+        # compressed data read but not yet decompressed
+        self.pending = ''
+        self.eof = False
+
+        if compressor == 'gzip':
+            self.decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif compressor == 'bzip2':
+            self.decomp = bz2.BZ2Decompressor()
+        elif EXTERNAL_DECOMPRESSORS.has_key(compressor):
+            cmd = EXTERNAL_DECOMPRESSORS[compressor]
+            if not os.access(cmd[0], os.X_OK):
+                self.f.close()
+                raise UnsupportedPayload("'%s' is needed to read %s payloads" % (cmd[0], compressor))
+            self.decomp = None
+            metrics.count(subprocesses=1)
+            self.proc = subprocess.Popen(cmd, stdin=self.f, stdout=subprocess.PIPE)
+        else:
+            self.f.close()
+            raise UnsupportedPayload("Unknown payload compressor '%s'" % compressor)
+
+    def _decompress(self):
+        """Return the next piece of the payload, of at most about CHUNK_SIZE
+        bytes for gzip; '' once the payload has ended"""
+
+        if not self.pending:
+            self.pending = self.f.read(CHUNK_SIZE)
+            if not self.pending:
+                self.eof = True
+                if hasattr(self.decomp, 'flush'):
+                    return self.decomp.flush()
+                return ''
+
+        if hasattr(self.decomp, 'unconsumed_tail'):
+            # zlib stops at CHUNK_SIZE, keeping the input it hasn't used
+            data = self.decomp.decompress(self.pending, CHUNK_SIZE)
+            self.pending = self.decomp.unconsumed_tail
+            return data
+
+        # python 2's bz2 can't be bounded, but only ever holds one
+        # bzip2 block of output
+        data, self.pending = self.pending, ''
+        try:
+            return self.decomp.decompress(data)
+        except EOFError:
+            # bz2 raises once the stream end has been passed
+            self.eof = True
+            return ''
+
+    def _fill(self, size):
+        chunks = [self.buf[self.pos:]]
+        have = len(chunks[0])
+        while have < size and not self.eof:
+            if self.proc:
+                data = self.proc.stdout.read(CHUNK_SIZE)
+                if not data:
+                    self.eof = True
+            else:
+                data = self._decompress()
+            chunks.append(data)
+            have += len(data)
+        self.buf = ''.join(chunks)
+        self.pos = 0
+
+    def read(self, size):
+        if len(self.buf) - self.pos < size:
+            self._fill(size)
+        data = self.buf[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        if self.proc:
+            self.proc.stdout.close()
+            self.proc.wait()
+        self.f.close()
+
+class _Entry(object):
+    """A single file in the payload, readable once, up to its size"""
+
+    def __init__(self, stream, name, mode, mtime, size):
+        self.stream = stream
+        self.name = name
+        self.mode = mode
+        self.mtime = mtime
+        self.size = size
+        self.left = size
+
+    def read(self, size=CHUNK_SIZE):
+        size = min(size, self.left)
+        if size <= 0:
+            return ''
+        data = self.stream.read(size)
+        if len(data) != size:
+            raise SkeinError("Truncated payload while reading '%s'" % self.name)
+        self.left -= size
+        return data
+
+    def skip(self):
+        while self.left:
+            self.read()
+
+def _pad(n):
+    return (4 - n % 4) % 4
+
+def payload_entries(path, rpminfo):
+    """Iterate over the files in an SRPM payload without unpacking it to disk
+
+    Each entry must be read (or skipped) before the next one is requested.
+
+    :param str path: path to the source RPM (SRPM)
+    :param dict rpminfo: srpm details from read_header
+    """
+
+    if rpminfo['payload_format'] != 'cpio':
+        raise UnsupportedPayload("Unknown payload format '%s'" % rpminfo['payload_format'])
+
+    stream = _Stream(path, rpminfo['payload_offset'], rpminfo['payload_compressor'])
+    try:
+        while True:
+            hdr = stream.read(CPIO_HEADER_SIZE)
+            if len(hdr) != CPIO_HEADER_SIZE:
+                raise SkeinError("Truncated cpio header in '%s'" % path)
+            if hdr[:6] not in CPIO_MAGIC:
+                # rpm >= 4.12 uses a stripped cpio format for files over 4GB
+                raise UnsupportedPayload("Unsupported cpio format '%s' in '%s'" % (hdr[:6], path))
+
+            fields = [int(hdr[6 + i * 8:14 + i * 8], 16) for i in range(13)]
+            mode, mtime, size, namesize = fields[1], fields[5], fields[6], fields[11]
+
+            name = stream.read(namesize)[:-1]
+            stream.read(_pad(CPIO_HEADER_SIZE + namesize))
+
+            if name == CPIO_TRAILER:
+                break
+
+            entry = _Entry(stream, name, mode, mtime, size)
+            yield entry
+            entry.skip()
+            stream.read(_pad(size))
+    finally:
+        stream.close()
+
+def extract_payload(path, rpminfo, dest_for, logger):
+    """Stream every regular file in an SRPM payload straight to its final place
+
+    :param str path: path to the source RPM (SRPM)
+    :param dict rpminfo: srpm details from read_header
+    :param dest_for: callable mapping a payload file name to a directory, or None to skip it
+    :param logger: logger for per-file messages
+    :returns: total bytes written
+    """
+
+    written = 0
+    for entry in payload_entries(path, rpminfo):
+        # srpm payloads are flat; never let a name escape the destination
+        name = os.path.basename(entry.name)
+        if not name or (entry.mode & 0170000) != 0100000:
+            continue
+
+        dest = dest_for(name)
+        if not dest:
+            continue
+
+        target = os.path.join(dest, name)
+        if os.path.isfile(target):
+            # same size and mtime as the payload copy: leave the file (and
+            # its inode, which keys the hash cache) alone
+            st = os.stat(target)
+            if st.st_size == entry.size and int(st.st_mtime) == entry.mtime:
+                logger.info("  '%s' unchanged in '%s'" % (name, dest))
+                continue
+
+        logger.info("  extracting '%s' to '%s'" % (name, dest))
+        tmp = "%s/.%s.partial" % (dest, name)
+        out = open(tmp, 'wb')
+        try:
+            data = entry.read()
+            while data:
+                out.write(data)
+                data = entry.read()
+        finally:
+            out.close()
+        os.chmod(tmp, entry.mode & 0777)
+        os.utime(tmp, (entry.mtime, entry.mtime))
+        os.rename(tmp, target)
+        written += entry.size
+
+    return written
@@ -0,0 +1,286 @@
+import time
+import logging
+
+def strongly_connected(deps):
+    """Tarjan's strongly connected components, without recursion so deep
+    dependency chains don't hit the recursion limit
+
+    :param dict deps: node to set of nodes it depends on
+    :returns: list of components (lists of nodes), each after every
+              component it depends on
+    """
+
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    counter = [0]
+
+    for root in sorted(deps):
+        if root in index:
+            continue
+        work = [(root, iter(sorted(deps[root])))]
+        index[root] = lowlink[root] = counter[0]
+        counter[0] += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = counter[0]
+                    counter[0] += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(sorted(deps[child]))))
+                    break
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+    return components
+
+class BuildGraph(object):
+    """Build order of a set of source packages, from their BuildRequires
+
+    A package depends on every other package in the set that provides one
+    of its BuildRequires.  Requirements provided only from outside the set
+    don't affect the order, and those nothing provides are kept in missing.
+    Packages that depend on each other, directly or not, form a cycle and
+    are built together as one group.
+
+    :param dict requires: package name to set of BuildRequires
+    :param index: provides.ProvidesIndex covering at least the set's packages
+    """
+
+    def __init__(self, requires, index):
+        self.names = set(requires)
+        self.deps = {}
+        satisfied, self.missing = index.resolve_all(requires)
+        for name, reqs in satisfied.items():
+            deps = set()
+            for req in reqs:
+                deps.update(index.providers(req))
+            deps &= self.names
+            deps.discard(name)
+            self.deps[name] = deps
+
+        self.groups = [tuple(component) for component in strongly_connected(self.deps)]
+        self.group_of = {}
+        for group in self.groups:
+            for name in group:
+                self.group_of[name] = group
+        self.group_deps = {}
+        for group in self.groups:
+            deps = set()
+            for name in group:
+                deps.update([self.group_of[dep] for dep in self.deps[name]])
+            deps.discard(group)
+            self.group_deps[group] = deps
+
+    def cycles(self):
+        """Return the groups of packages that depend on each other"""
+
+        return [group for group in self.groups if len(group) > 1]
+
+    def waves(self):
+        """Return the groups in waves: each wave needs only earlier waves built
+
+        :returns: list of waves, each a list of groups
+        """
+
+        wave_of = {}
+        waves = []
+        # groups come out of strongly_connected after everything they need
+        for group in self.groups:
+            wave = 0
+            for dep in self.group_deps[group]:
+                wave = max(wave, wave_of[dep] + 1)
+            wave_of[group] = wave
+            if wave == len(waves):
+                waves.append([])
+            waves[wave].append(group)
+        return waves
+
+    def dependents(self):
+        """Return a dict of group to the groups that depend on it"""
+
+        dependents = dict((group, set()) for group in self.groups)
+        for group, deps in self.group_deps.items():
+            for dep in deps:
+                dependents[dep].add(group)
+        return dependents
+
+class BuildScheduler(object):
+    """Submit the builds of a BuildGraph as their dependencies become usable
+
+    A group is submitted as soon as every group it depends on has built and
+    build_tag has a buildroot repo made since, rather than when its whole
+    wave has, so the build farm is kept busy.  A failed build skips every
+    group that depends on it.  Submitted builds are followed by a
+    kojiwatch.TreeWatcher, and the repo is checked in the same round trips.
+
+    :param graph: BuildGraph to build
+    :param submit: callable taking package names and returning a list of
+                   (name, task_id, error) tuples, e.g. PySkein._submit_builds
+    :param watcher: kojiwatch.TreeWatcher to follow the builds with
+    :param str build_tag: tag whose repo the builds' buildroots use
+    :param float repo_interval: seconds between checks for a new repo
+    :param float status_interval: seconds between status lines
+    """
+
+    def __init__(self, graph, submit, watcher, build_tag, repo_interval=30, status_interval=10):
+        self.graph = graph
+        self.submit = submit
+        self.watcher = watcher
+        self.build_tag = build_tag
+        self.repo_interval = float(repo_interval)
+        self.status_interval = float(status_interval)
+        self.logger = logging.getLogger('skein')
+
+        self.dependents = graph.dependents()
+        self.waiting = dict((group, len(graph.group_deps[group])) for group in graph.groups)
+        self.state = dict((group, 'waiting') for group in graph.groups)
+        self.tasks = {}
+        self.built_ts = {}
+        self.errors = {}
+        self.next_repo_check = 0
+
+    def _set(self, group, state):
+        self.state[group] = state
+        self.logger.info("  %s: %s" % (' '.join(group), state))
+
+    def _ready(self):
+        return [group for group in self.graph.groups if self.state[group] == 'waiting' and not self.waiting[group]]
+
+    def _submit_ready(self):
+        ready = self._ready()
+        if not ready:
+            return
+        names = [name for group in ready for name in group]
+        print "Submitting %d build(s): %s" % (len(names), ' '.join(names))
+        results = dict((name, (task_id, e)) for name, task_id, e in self.submit(names))
+        for group in ready:
+            tasks = []
+            for name in group:
+                task_id, e = results[name]
+                if e:
+                    self.errors[name] = e
+                    print "  %s: failed: %s" % (name, e)
+                else:
+                    tasks.append(task_id)
+                    self.watcher.add(task_id)
+            self.tasks[group] = tasks
+            if len(tasks) < len(group):
+                self._fail(group)
+            else:
+                self._set(group, 'building')
+
+    def _fail(self, group):
+        self._set(group, 'failed')
+        # everything above it, however far, can't build now
+        todo = list(self.dependents[group])
+        while todo:
+            dependent = todo.pop()
+            if self.state[dependent] == 'waiting':
+                self._set(dependent, 'skipped')
+                todo.extend(self.dependents[dependent])
+
+    def _collect(self):
+        for group in [g for g in self.graph.groups if self.state[g] == 'building']:
+            tasks = [self.watcher.tasks[task_id] for task_id in self.tasks[group]]
+            if [task for task in tasks if not task.is_done()]:
+                continue
+            if [task for task in tasks if not task.is_success()]:
+                self._fail(group)
+                continue
+            # hub time, to compare with the repo's; older hubs don't say
+            self.built_ts[group] = max([task.info.get('completion_ts') or time.time() for task in tasks])
+            if [dependent for dependent in self.dependents[group] if self.state[dependent] == 'waiting']:
+                self._set(group, 'built')
+            else:
+                # nothing waits on it, so there's no need to wait for a repo
+                self._set(group, 'available')
+
+    def _check_repo(self, now):
+        built = [group for group in self.graph.groups if self.state[group] == 'built']
+        if not built or now < self.next_repo_check:
+            return
+        self.next_repo_check = now + self.repo_interval
+        repo = self.watcher.multicall([('getRepo', (self.build_tag,), {})])[0]
+        self.watcher.rpcs += 1
+        if not repo:
+            return
+        for group in built:
+            if repo['create_ts'] >= self.built_ts[group]:
+                self._set(group, 'available')
+                for dependent in self.dependents[group]:
+                    self.waiting[dependent] -= 1
+
+    def counts(self):
+        counts = {}
+        for group, state in self.state.items():
+            counts[state] = counts.get(state, 0) + len(group)
+        return counts
+
+    def status(self):
+        counts = self.counts()
+        return "packages: %s | %s" % (', '.join(["%d %s" % (counts[state], state) for state in sorted(counts.keys())]),
+                self.watcher.status())
+
+    def _active(self):
+        return [group for group, state in self.state.items() if state in ('building', 'built')]
+
+    def run(self):
+        """Build every group, in order, until nothing more can be built
+
+        :returns: tuple of (built, failed, skipped) package name lists
+        """
+
+        last_status = time.time()
+        while True:
+            self._submit_ready()
+            if not self._active():
+                break
+            self.watcher.poll()
+            self._collect()
+            now = time.time()
+            self._check_repo(now)
+
+            if now - last_status >= self.status_interval:
+                msg = self.status()
+                self.logger.info(msg)
+                print msg
+                last_status = now
+
+            if self._ready():
+                continue
+            # sleep until the next task poll or repo check is due
+            due = []
+            if self.watcher.queue:
+                due.append(self.watcher.queue[0][0])
+            if [group for group in self._active() if self.state[group] == 'built']:
+                due.append(self.next_repo_check)
+            if due:
+                time.sleep(max(0, min(min(due) - time.time(), self.watcher.max_interval)))
+
+        msg = self.status()
+        self.logger.info(msg)
+        print msg
+
+        def _names(state):
+            return sorted([name for group in self.graph.groups if self.state[group] == state for name in group])
+        return _names('available'), _names('failed'), _names('skipped')